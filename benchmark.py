@@ -0,0 +1,379 @@
+# Copyright (c) 2024 Roman Boyarintsev
+# All rights reserved.
+#
+# This software is licensed under the Python Software Foundation License (PSF License) and GNU General Public License (GPL v3).
+# See LICENSE_PSF.txt and LICENSE_GPLv3.txt for details.
+#
+# Synthetic-scale benchmarks of rustdeskmanager, runs without a display:
+#   python benchmark.py --sizes 1000 10000 --trees 1:50 3:10 --output results.json
+# For every peers count and tree shape (group levels:fan-out) a temporary folder with
+# peer *.toml files and a config.dat is generated, then the hot paths are timed.
+# Per-file parse times of peer files are measured on real RustDesk files with --peers-folder,
+# on generated ones otherwise. Results are written as JSON.
+import argparse
+import json
+import os
+import pickle
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import toml
+from PyQt6.QtCore import QT_VERSION_STR
+from PyQt6.QtWidgets import QApplication
+
+import rustdeskcore
+import rustdeskmanager
+
+PEER_TEMPLATE = """password = [{password}]
+size = [0, 0, 1280, 800]
+size_ft = [0, 0, 0, 0]
+size_pf = [0, 0, 0, 0]
+view_style = 'adaptive'
+scroll_style = 'scrollauto'
+image_quality = 'balanced'
+custom_image_quality = [50]
+show_remote_cursor = false
+lock_after_session_end = false
+privacy_mode = false
+allow_swap_key = false
+port_forwards = []
+direct_failures = 0
+disable_audio = false
+disable_clipboard = false
+enable_file_transfer = true
+show_quality_monitor = false
+keyboard_mode = 'map'
+
+[options]
+alias = '{alias}'
+codec-preference = 'auto'
+zoom-cursor = ''
+i444 = ''
+
+[ui_flutter]
+wm_RemoteDesktop = '{{"width":1280.0,"height":800.0,"offsetWidth":0.0,"offsetHeight":0.0,"isMaximized":false}}'
+
+[info]
+username = '{username}'
+hostname = '{hostname}'
+platform = '{platform}'
+
+[transfer]
+write_jobs = []
+read_jobs = []
+"""
+
+PLATFORMS = ["Windows", "Linux", "Mac OS"]
+
+def peer_ids(count):
+    return [str(100000000 + i) for i in range(count)]
+
+def write_peers(folder, count):
+    os.makedirs(folder)
+    random.seed(count)
+    for i, peer_id in enumerate(peer_ids(count)):
+        password = ", ".join(str(random.randint(0, 255)) for _ in range(48))
+        with open(os.path.join(folder, peer_id + ".toml"), "w", encoding="utf-8") as f:
+            f.write(PEER_TEMPLATE.format(password=password, alias=f"Office {i % 500} PC {i}", username=f"user{i % 97}",
+                                         hostname=f"WS-{i:06d}", platform=PLATFORMS[i % len(PLATFORMS)]))
+
+def tree_structure(ids, levels, fanout):
+    # levels of groups with fanout children each, IDs spread over the deepest groups
+    groups = [{"text": f"Группа {i}", "children": []} for i in range(fanout)]
+    structure = groups
+    for level in range(1, levels):
+        deeper = []
+        for group in groups:
+            group["children"] = [{"text": f"{group['text']}.{i}", "children": []} for i in range(fanout)]
+            deeper.extend(group["children"])
+        groups = deeper
+    for i, peer_id in enumerate(ids):
+        groups[i % len(groups)]["children"].append({"text": peer_id, "children": []})
+    return structure
+
+def count_nodes(structure):
+    return sum(1 + count_nodes(item["children"]) for item in structure)
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class Timings:
+    def __init__(self, trace_memory):
+        self.trace_memory = trace_memory
+        self.results = {}
+
+    def measure(self, name, function, *args):
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = (time.perf_counter() - started) * 1000
+        entry = {"ms": round(elapsed, 3)}
+        if self.trace_memory:
+            entry["peak_traced_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        self.results[name] = entry
+        return result
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def deep_size(root):
+    # Bytes of Python objects reachable from root through containers and __slots__, shared objects once
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            stack.extend(getattr(obj, slot) for slot in getattr(type(obj), "__slots__", ()) if hasattr(obj, slot))
+    return size
+
+def wait_for_scan(app, window):
+    while window.scanners:
+        app.processEvents()
+
+def wait_for_rescan(app, window):
+    while window.startup_rescans or window.scanners:
+        app.processEvents()
+
+def start_interactive(app):
+    # Time to interactive is counted from here instead of the import of rustdeskmanager
+    window = rustdeskmanager.RustDeskManager(time.perf_counter())
+    window.show()
+    while window.time_to_interactive is None:
+        app.processEvents()
+    return window
+
+def write_config(peers_folder, fast_start):
+    with open("config.toml", "w", encoding="utf-8") as f:
+        toml.dump({"paths": {"work_folder_path": peers_folder, "rustdesk_path": ""},
+                   "WindowSize": {"width": 1000, "height": 700}, "Options": {"fast_start": fast_start}}, f)
+
+def run_parse_case(folder, repeat):
+    # Per-file time of a full toml parse, of tomllib and of the fast extractor of rustdeskcore
+    texts = []
+    for filename, key in rustdeskcore.iter_peer_files(folder):
+        try:
+            with open(os.path.join(folder, filename), "rb") as f:
+                texts.append(f.read().decode("utf-8"))
+        except (OSError, ValueError):
+            continue
+    parsers = {"toml": toml.loads, "extract_peer_details": rustdeskcore.extract_peer_details}
+    try:
+        import tomllib
+        parsers["tomllib"] = tomllib.loads
+    except ImportError:
+        pass
+    per_file_us = {}
+    for name, parse in parsers.items():
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                try:
+                    parse(text)
+                except ValueError:
+                    pass
+        per_file_us[name] = round((time.perf_counter() - started) * 1e6 / max(1, len(texts) * repeat), 1)
+    fallbacks = mismatches = 0
+    for text in texts:
+        details = rustdeskcore.extract_peer_details(text)
+        if details is None:
+            fallbacks += 1
+            continue
+        try:
+            if details != rustdeskcore.parse_peer_details(text):
+                mismatches += 1
+        except ValueError:
+            pass
+    return {
+        "folder": folder,
+        "files": len(texts),
+        "per_file_us": per_file_us,
+        "speedup_vs_toml": round(per_file_us["toml"] / max(per_file_us["extract_peer_details"], 0.1), 1),
+        "full_parse_fallbacks": fallbacks,
+        "mismatches": mismatches,
+    }
+
+def run_case(app, count, levels, fanout, selections, trace_memory, keep):
+    timings = Timings(trace_memory)
+    workdir = tempfile.mkdtemp(prefix="rustdeskmanager-bench-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        peers_folder = os.path.join(workdir, "peers")
+        write_peers(peers_folder, count)
+        ids = peer_ids(count)
+        structure = tree_structure(ids, levels, fanout)
+        write_config(peers_folder, fast_start=False)
+        with open("config.dat", "wb") as f:
+            pickle.dump({"TreeStructure": structure}, f)
+
+        # First start migrates config.dat, the second one loads config.db.
+        # RSS growth of the first start is meaningful for the first case of a run only.
+        rss_before = current_rss_kb()
+        window = timings.measure("startup_migrate_config_dat", rustdeskmanager.RustDeskManager)
+        wait_for_scan(app, window)
+        rss_after = current_rss_kb()
+        memory = {
+            "peer_data_bytes_per_peer": round(deep_size([window.ids_model.ids, window.known_ids, window.peer_sources,
+                                                         window.peer_index.entries]) / count),
+            "startup_rss_growth_bytes_per_peer": round((rss_after - rss_before) * 1024 / count) if rss_before is not None else None,
+        }
+        window.save_config()
+        window.tree_store.close()
+        window.deleteLater()
+        app.processEvents()
+
+        # Fast start from the listing and details saved above, until the first paint is done
+        # and the folder is checked again
+        write_config(peers_folder, fast_start=True)
+        window = timings.measure("startup_fast_to_interactive", start_interactive, app)
+        startup = {"time_to_first_paint_ms": round(window.time_to_first_paint, 3),
+                   "time_to_interactive_ms": round(window.time_to_interactive, 3),
+                   "time_to_tree_loaded_ms": round(window.time_to_tree_loaded, 3) if window.time_to_tree_loaded is not None else None}
+        timings.measure("startup_fast_rescan", wait_for_rescan, app, window)
+        window.fast_start_checkbox.setChecked(False)
+        window.close()
+        window.deleteLater()
+        app.processEvents()
+
+        window = timings.measure("load_config", rustdeskmanager.RustDeskManager)
+        timings.measure("load_ids", lambda: (window.load_ids(), wait_for_scan(app, window)))
+        timings.measure("tree_store_load", window.tree_store.load)
+        timings.measure("load_tree_structure", window.load_tree_structure, structure)
+
+        window.peer_index.entries = {}
+        timings.measure("item_value_update_cold", window.item_value_update)
+        timings.measure("item_value_update_warm", window.item_value_update)
+
+        # The search index is filled between events after loading, keystrokes only query it:
+        # the first one, a narrower query and clearing it
+        def index_search():
+            while window.search_pending:
+                app.processEvents()
+        timings.measure("search_index_idle", index_search)
+
+        def search(text):
+            # One filter per keystroke, without the throttle of search_text_changed
+            window.search_input.blockSignals(True)
+            window.search_input.setText(text)
+            window.search_input.blockSignals(False)
+            window.apply_search_filter()
+            app.processEvents()
+        timings.measure("search_first", search, "Office")
+        timings.measure("search_narrow", search, "Office 12")
+        timings.measure("search_clear", search, "")
+
+        random.seed(0)
+        nodes = [node for peer_id in random.sample(ids, min(selections, count)) for node in window.tree_items[peer_id][:1]]
+        for node in nodes:
+            window.show_node(node)
+
+        def select_all():
+            for node in nodes:
+                window.id_tree.setCurrentIndex(window.tree_model.index_of(node))
+        timings.measure("tree_selection_changed_x%d" % len(nodes), select_all)
+
+        timings.measure("save_config_unchanged", window.save_config)
+        for node in random.sample(list(window.tree_model.root.walk())[1:], max(1, count // 100)):
+            node.text += " *"
+        timings.measure("save_config_1pct_renamed", window.save_config)
+        window.tree_store.close()
+        os.remove("config.db")
+        window.tree_store.open()
+        window.tree_store.saved = {}
+        timings.measure("save_config_full", window.save_config)
+        window.tree_store.close()
+        window.deleteLater()
+        app.processEvents()
+    finally:
+        os.chdir(previous_cwd)
+        if not keep:
+            shutil.rmtree(workdir)
+    return {
+        "peers": count,
+        "tree": {"levels": levels, "fanout": fanout, "nodes": count_nodes(structure)},
+        "timings": timings.results,
+        "memory": memory,
+        "startup": startup,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-scale benchmarks of rustdeskmanager")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="peers counts")
+    parser.add_argument("--trees", nargs="+", default=["1:50", "3:10"], help="tree shapes as group levels:fan-out")
+    parser.add_argument("--selections", type=int, default=200, help="tree nodes selected one by one")
+    parser.add_argument("--trace-memory", action="store_true", help="trace peak Python memory of every step (slows timings down)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated folders")
+    parser.add_argument("--peers-folder", help="RustDesk peers folder for the per-file parse benchmark, generated files if omitted")
+    parser.add_argument("--parse-repeat", type=int, default=3, help="passes over the files of the parse benchmark")
+    parser.add_argument("--output", help="JSON file for the results, stdout if omitted")
+    args = parser.parse_args()
+
+    if args.peers_folder:
+        parse_result = run_parse_case(args.peers_folder, args.parse_repeat)
+    else:
+        workdir = tempfile.mkdtemp(prefix="rustdeskmanager-bench-")
+        try:
+            write_peers(os.path.join(workdir, "peers"), 1000)
+            parse_result = run_parse_case(os.path.join(workdir, "peers"), args.parse_repeat)
+        finally:
+            shutil.rmtree(workdir)
+        parse_result["folder"] = "generated"
+    print(f"parse {parse_result['files']} files of {parse_result['folder']}: "
+          + ", ".join(f"{name} {us:.0f} us" for name, us in parse_result["per_file_us"].items())
+          + f", speedup {parse_result['speedup_vs_toml']}x", file=sys.stderr)
+
+    app = QApplication(sys.argv[:1])
+    results = []
+    for count in args.sizes:
+        for shape in args.trees:
+            levels, fanout = (int(value) for value in shape.split(":"))
+            result = run_case(app, count, levels, fanout, args.selections, args.trace_memory, args.keep)
+            results.append(result)
+            print(f"{count} peers, tree {shape}: " + ", ".join(f"{name} {entry['ms']:.0f} ms" for name, entry in result["timings"].items())
+                  + ", " + ", ".join(f"{name} {value}" for name, value in result["memory"].items()), file=sys.stderr)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "parse": parse_result,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    else:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Copyright (c) 2024 Roman Boyarintsev
+# All rights reserved.
+#
+# This software is licensed under the Python Software Foundation License (PSF License) and GNU General Public License (GPL v3).
+# See LICENSE_PSF.txt and LICENSE_GPLv3.txt for details.
+#
+# Command line interface of rustdeskmanager, does not need Qt. Uses config.toml, config.db
+# and peers.json of the configuration folder (the current one by default) like the GUI:
+#   python rustdeskcli.py list
+#   python rustdeskcli.py find office
+#   python rustdeskcli.py tree
+#   python rustdeskcli.py connect 123456789
+#   python rustdeskcli.py connect "Office PC"
+#   python rustdeskcli.py export structure.csv
+#   python rustdeskcli.py import structure.json
+import argparse
+import csv
+import json
+import os
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from rustdeskcore import read_config, iter_peer_files, peer_sources, is_peer_id, PeerIndex, PeerRecord, TreeStore, TreeNode, build_tree,\
+    SessionLauncher, SearchIndex, TreeImporter, attach_nodes, read_tree, write_tree, tree_format
+
+DETAILS_KEYS = ("alias", "username", "hostname", "platform")
+
+def scan_folder(folder):
+    try:
+        return dict(iter_peer_files(folder))
+    except OSError as e:
+        print(f"Не удалось прочитать папку {folder}: {e}", file=sys.stderr)
+        return None
+
+def load_peers(folders, peer_index):
+    # Peer IDs of the folders mapped to their details and "source" folder. Folders are listed
+    # in parallel, an ID found in several of them comes from the newest file (see peer_sources).
+    # Only new and modified files are parsed, the rest comes from peers.json.
+    peer_index.load()
+    with ThreadPoolExecutor() as executor:
+        folder_stats = {folder: stats for folder, stats in zip(folders, executor.map(scan_folder, folders)) if stats is not None}
+    peer_ids = set()
+    for folder, stats in folder_stats.items():
+        peer_index.validate(folder, stats)
+        peer_index.prune(folder, stats)
+        peer_ids.update(os.path.splitext(filename)[0] for filename in stats)
+    sources = peer_sources(folders, folder_stats, peer_ids)
+    paths = {peer_id: os.path.join(folder, peer_id + ".toml") for peer_id, folder in sources.items()}
+    details = peer_index.get_many(paths.values())
+    peer_index.save()
+    return {peer_id: dict((details.get(paths[peer_id]) or PeerRecord()).as_dict(), source=sources[peer_id])
+            for peer_id in sorted(paths)}
+
+def load_tree(config_dir):
+    # Root TreeNode of config.db, or of config.dat while it was not migrated yet
+    store = TreeStore(os.path.join(config_dir, "config.db"))
+    if os.path.exists(store.path):
+        store.open()
+        try:
+            root = store.load()
+        finally:
+            store.close()
+        if root.children or not os.path.exists(os.path.join(config_dir, "config.dat")):
+            return root
+    try:
+        with open(os.path.join(config_dir, "config.dat"), "rb") as f:
+            return build_tree(pickle.load(f).get("TreeStructure", []), store.new_id)
+    except FileNotFoundError:
+        return build_tree([], store.new_id)
+    except (EOFError, pickle.UnpicklingError, AttributeError, KeyError, TypeError) as e:
+        raise ValueError(f"Не удалось прочитать структуру из config.dat: {e}") from e
+
+def peer_row(peer_id, details):
+    details = details or {}
+    return [peer_id] + [details.get(key) or "" for key in DETAILS_KEYS]
+
+def print_peers(peers, as_json):
+    keys = ("id",) + DETAILS_KEYS + ("source",)
+    rows = [peer_row(peer_id, details) + [os.path.normpath(details["source"])] for peer_id, details in peers.items()]
+    if as_json:
+        json.dump([dict(zip(keys, row)) for row in rows], sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    else:
+        for row in rows:
+            print("\t".join(row))
+
+def find_peers(peers, text):
+    index = SearchIndex()
+    for peer_id, details in peers.items():
+        index.set(peer_id, peer_row(peer_id, details))
+    matches = index.search(text)
+    return {peer_id: details for peer_id, details in peers.items() if peer_id in matches}
+
+def resolve_peer(peers, text):
+    # Returns the matches of an ID or alias: the ID itself, then peers with exactly this alias
+    # or hostname, then peers containing the text in any of their details
+    if text in peers:
+        return {text: peers[text]}
+    name = text.casefold()
+    matches = {peer_id: details for peer_id, details in peers.items()
+               if details and name in ((details["alias"] or "").casefold(), (details["hostname"] or "").casefold())}
+    return matches or find_peers(peers, text)
+
+def command_list(args, config, peer_index):
+    print_peers(load_peers(args.folders, peer_index), args.json)
+
+def command_find(args, config, peer_index):
+    matches = find_peers(load_peers(args.folders, peer_index), args.text)
+    print_peers(matches, args.json)
+    return 0 if matches else 1
+
+def command_tree(args, config, peer_index):
+    root = load_tree(args.config_dir)
+    if args.json:
+        json.dump(root.to_structure(), sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return
+    peer_index.load()
+    stack = [(child, 0) for child in reversed(root.children)]
+    while stack:
+        node, level = stack.pop()
+        line = "  " * level + node.text
+        if not node.children and is_peer_id(node.text):
+            # Cached details only, from the first folder that has them
+            details = next(filter(None, (peer_index.cached(os.path.join(folder, node.text + ".toml")) for folder in args.folders)), None)
+            if details and details.alias:
+                line += f"  ({details.alias})"
+        print(line)
+        stack.extend((child, level + 1) for child in reversed(node.children))
+
+def command_export(args, config, peer_index):
+    root = load_tree(args.config_dir)
+    file_format = args.format or tree_format(args.file)
+    if args.file == "-":
+        write_tree(root, sys.stdout, file_format)
+        return
+    with open(args.file, "w", encoding="utf-8-sig" if file_format == "csv" else "utf-8", newline="") as f:
+        write_tree(root, f, file_format)
+
+def command_import(args, config, peer_index):
+    # Merges into config.db like the GUI, or replaces the structure with --replace.
+    # The GUI should not be running, it would overwrite the result on exit.
+    store = TreeStore(os.path.join(args.config_dir, "config.db"))
+    store.open()
+    try:
+        root = store.load()
+        if not root.children and os.path.exists(os.path.join(args.config_dir, "config.dat")):
+            print("Структура ещё в config.dat: запустите rustdeskmanager один раз для переноса в config.db", file=sys.stderr)
+            return 1
+        importer = TreeImporter(TreeNode(None, "") if args.replace else root, store.new_id, not args.replace)
+        with open(args.file, "r", encoding="utf-8-sig", newline="") as f:
+            for path in read_tree(f, args.format or tree_format(args.file)):
+                importer.add(path)
+        attach_nodes(importer.flush())
+        store.save(importer.root)
+    except (ValueError, csv.Error) as e:
+        print(f"Не удалось загрузить {args.file}: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    print(f"Добавлено: {importer.added}, уже было в структуре: {importer.skipped}")
+
+def command_connect(args, config, peer_index):
+    program = args.rustdesk or config.get("paths", {}).get("rustdesk_path", "")
+    if program == "":
+        print("Путь к Rustdesk не задан: укажите его в настройках или параметром --rustdesk", file=sys.stderr)
+        return 2
+    if is_peer_id(args.peer):
+        peer_id = args.peer
+    else:
+        matches = resolve_peer(load_peers(args.folders, peer_index), args.peer)
+        if len(matches) != 1:
+            print(f"Не найдено: {args.peer}" if not matches else f"Найдено несколько ID для {args.peer}:", file=sys.stderr)
+            for peer_id, details in matches.items():
+                print("\t".join(peer_row(peer_id, details)), file=sys.stderr)
+            return 1
+        peer_id = next(iter(matches))
+    program = os.path.normpath(program)
+    if args.dry_run:
+        print(" ".join([program, "--connect", peer_id]))
+        return
+    launcher = SessionLauncher()
+    launcher.connect(program, [peer_id])
+    if launcher.errors:
+        program, error = launcher.errors[-1]
+        print(f"Не удалось запустить {program}: {error}", file=sys.stderr)
+        return 1
+    print(peer_id)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="rustdeskmanager без графического интерфейса")
+    parser.add_argument("--config-dir", default=".", help="папка с config.toml, config.db и peers.json (по умолчанию текущая)")
+    parser.add_argument("--work-folder", action="append",
+                        help="папка с файлами *.toml Rustdesk вместо указанных в config.toml, можно указать несколько раз")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="все ID папок с названием, пользователем, компьютером, системой и папкой")
+    list_parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    list_parser.set_defaults(function=command_list)
+    find_parser = commands.add_parser("find", help="ID, в описании которых есть текст")
+    find_parser.add_argument("text")
+    find_parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    find_parser.set_defaults(function=command_find)
+    tree_parser = commands.add_parser("tree", help="структура групп")
+    tree_parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    tree_parser.set_defaults(function=command_tree)
+    export_parser = commands.add_parser("export", help="сохранить структуру в JSON или CSV (путь группы, ID)")
+    export_parser.add_argument("file", help="файл *.json или *.csv, - для вывода на экран")
+    export_parser.add_argument("--format", choices=("json", "csv"), help="формат вместо определяемого по расширению")
+    export_parser.set_defaults(function=command_export)
+    import_parser = commands.add_parser("import", help="добавить в структуру группы и ID из JSON или CSV")
+    import_parser.add_argument("file", help="файл *.json или *.csv")
+    import_parser.add_argument("--format", choices=("json", "csv"), help="формат вместо определяемого по расширению")
+    import_parser.add_argument("--replace", action="store_true", help="заменить структуру вместо объединения")
+    import_parser.set_defaults(function=command_import)
+    connect_parser = commands.add_parser("connect", help="подключиться к ID или названию")
+    connect_parser.add_argument("peer", help="ID, название или часть описания, совпадающая только с одним ID")
+    connect_parser.add_argument("--rustdesk", help="исполняемый файл Rustdesk вместо указанного в config.toml")
+    connect_parser.add_argument("--dry-run", action="store_true", help="только вывести команду запуска")
+    connect_parser.set_defaults(function=command_connect)
+    args = parser.parse_args(argv)
+
+    config = read_config(os.path.join(args.config_dir, "config.toml"))
+    # Peer sources in order of precedence on equal mtime, like in the GUI
+    folders = args.work_folder
+    if folders is None:
+        paths = config.get("paths", {})
+        folders = [paths.get("work_folder_path", "")] + paths.get("extra_folder_paths", [])
+    args.folders = list(dict.fromkeys(folder for folder in folders if folder != ""))
+    if not args.folders and args.command in ("list", "find"):
+        parser.error("папка с файлами *.toml не задана: укажите её в настройках или параметром --work-folder")
+    # Loaded by the commands that need peer details, connecting to an ID does not
+    peer_index = PeerIndex(os.path.join(args.config_dir, "peers.json"))
+    try:
+        return args.function(args, config, peer_index) or 0
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,863 @@
+# Copyright (c) 2024 Roman Boyarintsev
+# All rights reserved.
+#
+# This software is licensed under the Python Software Foundation License (PSF License) and GNU General Public License (GPL v3).
+# See LICENSE_PSF.txt and LICENSE_GPLv3.txt for details.
+# Qt-free core of rustdeskmanager: peer details cache, tree store, session launcher and search.
+# Used by the GUI and by the command line interface rustdeskcli.py.
+import os
+import sys
+import re
+import toml
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from collections import deque
+# concurrent.futures, subprocess, cProfile, tomllib, csv and json are imported on first use,
+# none of them is needed before the GUI is shown. sqlite3 is imported by TreeStore.open,
+# which the GUI calls before it is shown, so only callers without a tree skip it.
+
+PEER_INDEX_VERSION = 3
+# Cache misses in network folders are read by this many threads, so the waits for the share
+# overlap. Local files are parsed one by one, parsing holds the GIL and a pool only adds overhead.
+NETWORK_READ_WORKERS = 8
+DEFAULT_MAX_SESSIONS = 4
+# Instrumentation is switched on by INSTRUMENTATION_ENV=1 or Options.instrumentation of config.toml,
+# PROFILE_ENV=file.prof profiles the whole session with cProfile
+INSTRUMENTATION_ENV = "RUSTDESKMANAGER_STATS"
+PROFILE_ENV = "RUSTDESKMANAGER_PROFILE"
+# Upper bounds of latency histogram buckets in milliseconds, the last bucket is unbounded
+HISTOGRAM_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+# Keys of peer *.toml files shown as details, by table
+PEER_DETAILS_KEYS = {"options": ("alias",), "info": ("username", "hostname", "platform")}
+PEER_TABLE_RE = re.compile(r"^[ \t]*\[\[?[ \t]*([A-Za-z0-9_.-]+)[ \t]*\]\]?[ \t]*(?:#.*)?\r?$", re.MULTILINE)
+PEER_STRING_RE = re.compile(r"'([^'\r\n]*)'|\"([^\"\\\r\n]*)\"")
+# Tree import and export: group path separator of CSV files, nodes handed to the view at once,
+# characters read at once and tokens of JSON files
+TREE_PATH_SEPARATOR = " / "
+IMPORT_BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 65536
+JSON_TOKEN_RE = re.compile(r'\s*(?:([\[\]{},:])|("[^"\\]*(?:\\.[^"\\]*)*")|(-?[0-9][0-9.eE+-]*|true|false|null))')
+
+class Instrumentation:
+    # Call counts, latency histograms and counters of the hot paths. record() and count()
+    # do nothing while disabled, they are called from scanner and parser threads as well.
+    def __init__(self):
+        self.forced = os.environ.get(INSTRUMENTATION_ENV, "") not in ("", "0")
+        self.enabled = self.forced
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def record(self, name, elapsed_ms):
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {"calls": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                               "histogram": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)}
+            timing["calls"] += 1
+            timing["total_ms"] += elapsed_ms
+            timing["max_ms"] = max(timing["max_ms"], elapsed_ms)
+            timing["histogram"][bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def measure(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def timer(self, name):
+        # with instrumentation.timer("name"): ... records the latency of the block
+        return self.measure(name) if self.enabled else nullcontext()
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}"]
+        with self.lock:
+            timings = {name: {"calls": timing["calls"],
+                              "total_ms": round(timing["total_ms"], 3),
+                              "avg_ms": round(timing["total_ms"] / timing["calls"], 3),
+                              "max_ms": round(timing["max_ms"], 3),
+                              "histogram_ms": dict(zip(labels, timing["histogram"]))}
+                       for name, timing in self.timings.items()}
+            counters = dict(self.counters)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "enabled": self.enabled,
+            "timings": timings,
+            "counters": counters,
+        }
+
+    def report(self):
+        snapshot = self.snapshot()
+        labels = [f"<={bound}" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}"]
+        lines = [f"Сбор включён: {'да' if snapshot['enabled'] else 'нет'}, с {snapshot['started']}", "",
+                 f"{'':<24}{'вызовы':>8}{'всего мс':>11}{'сред. мс':>10}{'макс. мс':>10}  "
+                 + " ".join(f"{label:>6}" for label in labels)]
+        for name, timing in sorted(snapshot["timings"].items()):
+            lines.append(f"{name:<24}{timing['calls']:>8}{timing['total_ms']:>11.1f}{timing['avg_ms']:>10.1f}"
+                         f"{timing['max_ms']:>10.1f}  " + " ".join(f"{count:>6}" for count in timing["histogram_ms"].values()))
+        if snapshot["counters"]:
+            lines.append("")
+            lines.extend(f"{name:<24}{value:>8}" for name, value in sorted(snapshot["counters"].items()))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            import json
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def start_profile(self):
+        if self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, path=None):
+        # Stops profiling and writes pstats data to path unless it is empty
+        if self.profiler is None:
+            return
+        self.profiler.disable()
+        if path:
+            self.profiler.dump_stats(path)
+        self.profiler = None
+
+instrumentation = Instrumentation()
+
+def is_peer_id(text):
+    # RustDesk IDs are numbers of at least 7 digits, other tree texts are groups
+    return text.isdigit() and len(text) >= 7
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class PeerRecord:
+    # Details of a peer file. PeerIndex keeps one record per file and hands out that instance,
+    # so the list, tree columns and details pane share it. Usernames and platforms repeat
+    # across peers and are interned.
+    __slots__ = ("alias", "username", "hostname", "platform")
+
+    def __init__(self, alias=None, username=None, hostname=None, platform=None):
+        self.alias = alias
+        self.username = intern_value(username)
+        self.hostname = hostname
+        self.platform = intern_value(platform)
+
+    def __eq__(self, other):
+        return isinstance(other, PeerRecord) and all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def __repr__(self):
+        return "PeerRecord(" + ", ".join(f"{key}={getattr(self, key)!r}" for key in self.__slots__) + ")"
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+def read_peer_details(filename):
+    with instrumentation.timer("read_peer_details"):
+        with open(filename, "rb") as f:
+            text = f.read().decode("utf-8")
+        details = extract_peer_details(text)
+        if details is None:
+            instrumentation.count("toml_full_parses")
+            details = parse_peer_details(text)
+    instrumentation.count("toml_files_parsed")
+    return details
+
+def parse_peer_details(text):
+    # Full parse, by tomllib if available. Errors are reported by toml as before.
+    try:
+        import tomllib
+    except ImportError:
+        tomllib = None
+    config = None
+    if tomllib is not None:
+        try:
+            config = tomllib.loads(text)
+        except tomllib.TOMLDecodeError:
+            pass
+    if config is None:
+        config = toml.loads(text)
+    return PeerRecord(config.get("options", {}).get("alias"), config.get("info", {}).get("username"),
+                      config.get("info", {}).get("hostname"), config.get("info", {}).get("platform"))
+
+def extract_peer_details(text):
+    # Reads the details keys from the lines of [options] and [info] only, the rest of the file
+    # (password, sizes, ui_flutter blobs) is skipped. Returns None for anything but plain
+    # single-line strings there, quoted or dotted keys, multi-line strings or a repeated table,
+    # then the file needs a full parse.
+    details = dict.fromkeys(key for keys in PEER_DETAILS_KEYS.values() for key in keys)
+    headers = list(PEER_TABLE_RE.finditer(text))
+    seen = set()
+    for i, header in enumerate(headers):
+        table = header.group(1)
+        if table not in PEER_DETAILS_KEYS:
+            continue
+        if table in seen:
+            return None
+        seen.add(table)
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        section = text[header.end():end]
+        if "'''" in section or '"""' in section:
+            return None
+        for line in section.splitlines():
+            key, separator, value = line.partition("=")
+            key = key.strip()
+            if not separator or key.startswith("#"):
+                continue
+            if key.startswith(('"', "'")) or "." in key:
+                return None
+            if key in PEER_DETAILS_KEYS[table]:
+                value = value.strip()
+                match = PEER_STRING_RE.match(value)
+                if match is None or value[match.end():].strip()[:1] not in ("", "#"):
+                    return None
+                details[key] = match.group(1) if match.group(1) is not None else match.group(2)
+    return PeerRecord(**details)
+
+@functools.lru_cache(maxsize=None)
+def is_network_folder(folder):
+    # UNC paths and, on Windows, folders of mapped network drives
+    if folder.startswith(("\\\\", "//")):
+        return True
+    if os.name != "nt":
+        return False
+    import ctypes
+    drive = os.path.splitdrive(os.path.abspath(folder))[0]
+    # DRIVE_REMOTE
+    return bool(drive) and ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == 4
+
+class PeerIndex:
+    # Details of peer *.toml files kept between runs in cache_path. Entries are flat
+    # (size, mtime, PeerRecord) tuples, valid while size and mtime of the file are unchanged.
+    # folders keeps the last complete listing of every peer folder for a fast start.
+    # The cache is plain JSON, a damaged or foreign one is dropped and built again.
+    def __init__(self, cache_path="peers.json"):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.folders = {}
+        self.hits = 0
+        self.misses = 0
+        self.changed = False
+
+    def load(self):
+        import json
+        self.entries = {}
+        self.folders = {}
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("version") != PEER_INDEX_VERSION:
+                return
+            entries = {path: (size, mtime, PeerRecord(alias, username, hostname, platform))
+                       for path, size, mtime, alias, username, hostname, platform in cache["entries"]}
+            folders = {folder: {filename: (size, mtime) for filename, size, mtime in stats}
+                       for folder, stats in cache["folders"].items()}
+        except Exception:
+            # Only a cache, whatever is wrong with it
+            return
+        self.entries = entries
+        self.folders = folders
+
+    def save(self):
+        if not self.changed:
+            return
+        import json
+        cache = {
+            "version": PEER_INDEX_VERSION,
+            "entries": [(path, size, mtime, details.alias, details.username, details.hostname, details.platform)
+                        for path, (size, mtime, details) in self.entries.items()],
+            "folders": {folder: [(filename, *key) for filename, key in stats.items()] for folder, stats in self.folders.items()},
+        }
+        temp_path = self.cache_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, self.cache_path)
+        self.changed = False
+
+    def set_folders(self, folders):
+        # Listings of peer folders as {folder: {file name: (size, mtime)}}
+        if folders != self.folders:
+            self.folders = folders
+            self.changed = True
+
+    def validate(self, folder, stats):
+        # Drop entries of modified files, stats maps file names of the folder to (size, mtime)
+        for filename, key in stats.items():
+            path = os.path.join(folder, filename)
+            entry = self.entries.get(path)
+            if entry is not None and (entry[0], entry[1]) != key:
+                del self.entries[path]
+                self.changed = True
+
+    def prune(self, folder, filenames):
+        # Drop entries of the folder whose files are gone
+        alive = {os.path.join(folder, filename) for filename in filenames}
+        folder = os.path.join(folder, "")
+        for path in [path for path in self.entries if path.startswith(folder) and path not in alive]:
+            del self.entries[path]
+            self.changed = True
+
+    def get(self, path):
+        entry = self.entries.get(path)
+        if entry is not None:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        stat = os.stat(path)
+        details = read_peer_details(path)
+        self.entries[path] = (stat.st_size, stat.st_mtime_ns, details)
+        self.changed = True
+        return details
+
+    def get_many(self, paths):
+        # Same as get() for many files at once. Cache misses are parsed in turn, those of network
+        # folders on a pool of NETWORK_READ_WORKERS threads.
+        # Files that are missing or can not be parsed are left out of the result.
+        result = {}
+        missing = []
+        for path in paths:
+            entry = self.entries.get(path)
+            if entry is not None:
+                result[path] = entry[2]
+            else:
+                missing.append(path)
+        self.hits += len(result)
+        self.misses += len(missing)
+        remote = [path for path in missing if is_network_folder(os.path.dirname(path))]
+        local = [path for path in missing if not is_network_folder(os.path.dirname(path))] if remote else missing
+        read = list(zip(local, map(self.read_entry, local)))
+        if remote:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=NETWORK_READ_WORKERS) as executor:
+                read += zip(remote, executor.map(self.read_entry, remote))
+        for path, entry in read:
+            if entry is not None:
+                self.entries[path] = entry
+                result[path] = entry[2]
+                self.changed = True
+        return result
+
+    def cached(self, path):
+        entry = self.entries.get(path)
+        return entry[2] if entry is not None else None
+
+    @staticmethod
+    def read_entry(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_size, stat.st_mtime_ns, read_peer_details(path)
+        except (OSError, ValueError):
+            # toml.TomlDecodeError and UnicodeDecodeError are ValueErrors
+            return None
+
+class TreeStore:
+    # Tree structure in SQLite, one row per node. Nodes keep their ids between saves,
+    # so a save writes only added, moved, renamed and deleted nodes in one transaction.
+    def __init__(self, path="config.db"):
+        self.path = path
+        self.connection = None
+        self.saved = {}
+        self.last_id = 0
+
+    def open(self):
+        import sqlite3
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS nodes ("
+                                    "id INTEGER PRIMARY KEY, parent_id INTEGER, position INTEGER NOT NULL, text TEXT NOT NULL)")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def new_id(self):
+        self.last_id += 1
+        return self.last_id
+
+    def load(self):
+        # Returns the root TreeNode of the stored structure
+        rows = self.connection.execute("SELECT id, parent_id, position, text FROM nodes ORDER BY position").fetchall()
+        self.saved = {node_id: (parent_id, position, text) for node_id, parent_id, position, text in rows}
+        self.last_id = max(self.saved, default=0)
+        root = TreeNode(None, "")
+        # Texts are interned, so a peer ID in the tree and in the peer list is one string
+        nodes = {node_id: TreeNode(node_id, sys.intern(text)) for node_id, parent_id, position, text in rows}
+        for node_id, parent_id, position, text in rows:
+            node = nodes[node_id]
+            node.parent = nodes.get(parent_id, root)
+            node.parent.children.append(node)
+        return root
+
+    def load_top(self):
+        # Root with the top-level nodes only, without their children, to be shown until
+        # load() is done. Leaves saved and last_id to load().
+        rows = self.connection.execute("SELECT id, text FROM nodes WHERE parent_id IS NULL ORDER BY position").fetchall()
+        root = TreeNode(None, "")
+        root.children = [TreeNode(node_id, sys.intern(text), root) for node_id, text in rows]
+        return root
+
+    def save(self, root):
+        nodes = {}
+        for parent in root.walk():
+            for position, node in enumerate(parent.children):
+                nodes[node.id] = (parent.id, position, node.text)
+        changed = [(node_id,) + node for node_id, node in nodes.items() if self.saved.get(node_id) != node]
+        deleted = [(node_id,) for node_id in self.saved if node_id not in nodes]
+        if not changed and not deleted:
+            return
+        with self.connection:
+            self.connection.executemany("DELETE FROM nodes WHERE id = ?", deleted)
+            self.connection.executemany("INSERT OR REPLACE INTO nodes (id, parent_id, position, text) VALUES (?, ?, ?, ?)", changed)
+        self.saved = nodes
+
+    def replace(self, root):
+        # Writes the whole structure to a new database and puts it in place of path at once,
+        # so a failed or interrupted write leaves the previous file as it was
+        temp_path = self.path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        temp = TreeStore(temp_path)
+        temp.open()
+        try:
+            temp.save(root)
+        finally:
+            temp.close()
+        self.close()
+        os.replace(temp_path, self.path)
+        self.open()
+        self.saved = temp.saved
+
+class TreeNode:
+    # Node of the group structure, root has no text and no parent.
+    # fetched is set by PeerTreeModel once the children were shown as rows.
+    __slots__ = ("id", "text", "parent", "children", "fetched")
+
+    def __init__(self, node_id, text, parent=None):
+        self.id = node_id
+        self.text = text
+        self.parent = parent
+        self.children = []
+        self.fetched = False
+
+    def row(self):
+        return self.parent.children.index(self)
+
+    def walk(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def ancestors(self):
+        # Parents up to, but not including the root
+        node = self.parent
+        while node is not None and node.parent is not None:
+            yield node
+            node = node.parent
+
+    def to_structure(self):
+        return [{"text": child.text, "children": child.to_structure()} for child in self.children]
+
+def build_tree(structure, new_id):
+    # Nodes from nested dicts of "text" and "children", with "id" if known
+    root = TreeNode(None, "")
+    stack = [(root, structure)]
+    while stack:
+        parent, items = stack.pop()
+        for item in items:
+            node = TreeNode(item.get("id") or new_id(), sys.intern(item["text"]), parent)
+            parent.children.append(node)
+            stack.append((node, item.get("children", [])))
+    return root
+
+def tree_format(filename):
+    return "csv" if filename.lower().endswith(".csv") else "json"
+
+def write_tree_json(root, f):
+    # Same nested "text" and "children" lists as TreeNode.to_structure, written node by node
+    import json
+    f.write("[")
+    stack = [iter(root.children)]
+    first = True
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            f.write("\n" + "  " * len(stack) + ("]}" if stack else "]\n"))
+            first = False
+            continue
+        f.write(("\n" if first else ",\n") + "  " * len(stack) + '{"text": ' + json.dumps(node.text, ensure_ascii=False) + ', "children": [')
+        if node.children:
+            stack.append(iter(node.children))
+            first = True
+        else:
+            f.write("]}")
+            first = False
+
+def tree_csv_rows(root):
+    # Rows of group path and peer ID, groups without IDs have an empty ID
+    stack = [(child, ()) for child in reversed(root.children)]
+    while stack:
+        node, path = stack.pop()
+        if node.children:
+            stack.extend((child, path + (node.text,)) for child in reversed(node.children))
+        elif is_peer_id(node.text):
+            yield TREE_PATH_SEPARATOR.join(path), node.text
+        else:
+            yield TREE_PATH_SEPARATOR.join(path + (node.text,)), ""
+
+def write_tree(root, f, tree_format="json"):
+    if tree_format == "csv":
+        import csv
+        writer = csv.writer(f)
+        writer.writerow(("path", "id"))
+        writer.writerows(tree_csv_rows(root))
+    else:
+        write_tree_json(root, f)
+
+def read_tree_csv(f):
+    # Paths of the nodes of CSV rows, read row by row
+    import csv
+    for row in csv.reader(f):
+        if not row or row == ["path", "id"]:
+            continue
+        path = tuple(text.strip() for text in row[0].split(TREE_PATH_SEPARATOR) if text.strip())
+        peer_id = row[1].strip() if len(row) > 1 else ""
+        if peer_id:
+            path += (sys.intern(peer_id),)
+        if path:
+            yield path
+
+def iter_json_tokens(f):
+    # Tokens of a JSON document as (kind, value), kind being the punctuation, "string" or "value".
+    # Read in chunks, so only the current token is kept in memory.
+    import json
+    match_token = JSON_TOKEN_RE.match
+    punctuation = {kind: (kind, None) for kind in "[]{},:"}
+    buffer = ""
+    position = 0
+    end_of_file = False
+    while True:
+        limit = len(buffer)
+        while True:
+            match = match_token(buffer, position)
+            # A token ending the buffer may continue in the next chunk
+            if match is None or match.end() == limit and not end_of_file:
+                break
+            position = match.end()
+            group = match.lastindex
+            if group == 1:
+                yield punctuation[match.group(1)]
+            elif group == 2:
+                string = match.group(2)
+                yield "string", json.loads(string) if "\\" in string else string[1:-1]
+            else:
+                yield "value", json.loads(match.group(3))
+        chunk = "" if end_of_file else f.read(JSON_CHUNK_SIZE)
+        if chunk:
+            buffer = buffer[position:] + chunk
+            position = 0
+        elif not end_of_file:
+            end_of_file = True
+        elif buffer[position:].strip():
+            raise ValueError(f"Ошибка JSON около: {buffer[position:position + 40]!r}")
+        else:
+            return
+
+def check_json_token(token, *kinds):
+    if token[0] not in kinds:
+        raise ValueError(f"Ошибка JSON: ожидалось {' '.join(kinds)}, получено {token[1] if token[0] in ('string', 'value') else token[0]}")
+    return token
+
+def next_json_token(tokens, *kinds):
+    token = next(tokens, None)
+    if token is None:
+        raise ValueError("Неожиданный конец JSON")
+    return check_json_token(token, *kinds) if kinds else token
+
+def iter_json_items(tokens, end):
+    # First token of every element of a list or an object after its opening bracket, the caller
+    # reads the rest of the element before the next one. Elements have to be separated by commas.
+    token = next_json_token(tokens)
+    if token[0] == end:
+        return
+    while True:
+        yield token
+        if next_json_token(tokens, ",", end)[0] == end:
+            return
+        token = next_json_token(tokens)
+
+def skip_json_value(tokens, token=None):
+    kind = (token or next_json_token(tokens))[0]
+    if kind == "[":
+        for token in iter_json_items(tokens, "]"):
+            skip_json_value(tokens, token)
+    elif kind == "{":
+        for token in iter_json_items(tokens, "}"):
+            check_json_token(token, "string")
+            next_json_token(tokens, ":")
+            skip_json_value(tokens)
+    else:
+        check_json_token((kind, None), "[", "{", "string", "value")
+
+def read_json_nodes(tokens, path):
+    # Nodes of a "children" list after its "[". A node is given as soon as its "text" is read,
+    # so "text" has to precede "children".
+    for token in iter_json_items(tokens, "]"):
+        check_json_token(token, "{")
+        text = None
+        for token in iter_json_items(tokens, "}"):
+            key = check_json_token(token, "string")[1]
+            next_json_token(tokens, ":")
+            if key == "text":
+                text = sys.intern(next_json_token(tokens, "string")[1])
+                yield path + (text,)
+            elif key == "children":
+                if text is None:
+                    raise ValueError('Ошибка JSON: "text" узла должен быть перед "children"')
+                next_json_token(tokens, "[")
+                yield from read_json_nodes(tokens, path + (text,))
+            else:
+                skip_json_value(tokens)
+        if text is None:
+            raise ValueError('Ошибка JSON: у узла нет "text"')
+
+def read_tree_json(f):
+    # Paths of the nodes of a JSON structure, in document order
+    tokens = iter_json_tokens(f)
+    next_json_token(tokens, "[")
+    yield from read_json_nodes(tokens, ())
+    if next(tokens, None) is not None:
+        raise ValueError("Ошибка JSON: лишние данные после структуры")
+
+def read_tree(f, tree_format="json"):
+    return read_tree_csv(f) if tree_format == "csv" else read_tree_json(f)
+
+class TreeImporter:
+    # Adds nodes given by their paths, each path being the texts of the ancestors and the node.
+    # Ancestors are looked up by text or created. In merge mode a node that already exists is
+    # reused instead of added again, so groups are merged and IDs are not duplicated.
+    # New nodes are collected until flush() returns them as (parent, nodes) batches.
+    def __init__(self, root, new_id, merge=True):
+        self.root = root
+        self.new_id = new_id
+        self.merge = merge
+        self.path = []
+        self.texts = []
+        self.children = {}
+        self.pending = {}
+        self.detached = set()
+        self.pending_count = 0
+        self.added = 0
+        self.skipped = 0
+
+    def child(self, parent, text):
+        children = self.children.get(parent)
+        if children is None:
+            children = self.children[parent] = {}
+            for child in parent.children:
+                children.setdefault(child.text, child)
+        return children.get(text)
+
+    def create(self, parent, text):
+        node = TreeNode(self.new_id(), text)
+        if parent in self.detached:
+            node.parent = parent
+            parent.children.append(node)
+        else:
+            self.pending.setdefault(parent, []).append(node)
+        self.detached.add(node)
+        children = self.children.get(parent)
+        if children is not None:
+            children.setdefault(text, node)
+        self.pending_count += 1
+        self.added += 1
+        return node
+
+    def add(self, path):
+        # The nodes of the previous path are reused while the texts match
+        depth = 0
+        while depth < len(path) - 1 and depth < len(self.texts) and self.texts[depth] == path[depth]:
+            depth += 1
+        del self.path[depth:], self.texts[depth:]
+        parent = self.path[-1] if self.path else self.root
+        for text in path[depth:-1]:
+            parent = self.child(parent, text) or self.create(parent, text)
+            self.path.append(parent)
+            self.texts.append(text)
+        node = self.child(parent, path[-1]) if self.merge else None
+        if node is None:
+            node = self.create(parent, path[-1])
+        else:
+            self.skipped += 1
+        self.path.append(node)
+        self.texts.append(path[-1])
+
+    def flush(self):
+        batch = list(self.pending.items())
+        self.pending = {}
+        self.detached = set()
+        self.pending_count = 0
+        return batch
+
+def attach_nodes(batch):
+    # Adds the batches of TreeImporter.flush to a tree that is not shown by a model
+    for parent, nodes in batch:
+        for node in nodes:
+            node.parent = parent
+        parent.children.extend(nodes)
+
+class Session:
+    # A started RustDesk process, peer_id is None for the main application
+    __slots__ = ("peer_id", "process", "started", "returncode")
+
+    def __init__(self, peer_id, process):
+        self.peer_id = peer_id
+        self.process = process
+        self.started = time.time()
+        self.returncode = None
+
+class SessionLauncher:
+    # Starts RustDesk without a shell and tracks the processes. At most max_sessions
+    # connections run at once, the rest wait in the queue. poll() reaps finished
+    # processes and starts queued connections.
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.queue = deque()
+        self.sessions = {}
+        self.finished = deque(maxlen=20)
+        self.errors = []
+
+    def is_active(self, peer_id):
+        return peer_id in self.sessions or any(queued_id == peer_id for program, queued_id in self.queue)
+
+    def connect(self, program, peer_ids):
+        # Returns the IDs accepted, IDs already running or queued are skipped
+        accepted = []
+        for peer_id in peer_ids:
+            if not self.is_active(peer_id) and peer_id not in accepted:
+                self.queue.append((program, peer_id))
+                accepted.append(peer_id)
+        self.start_queued()
+        return accepted
+
+    def run(self, program):
+        # The main application, not counted against max_sessions
+        if None not in self.sessions:
+            self.start(program, None, [program])
+
+    def start(self, program, peer_id, command):
+        import subprocess
+        try:
+            with instrumentation.timer("process_launch"):
+                self.sessions[peer_id] = Session(peer_id, subprocess.Popen(command))
+            instrumentation.count("processes_started")
+        except OSError as e:
+            instrumentation.count("process_launch_errors")
+            self.errors.append((program, str(e)))
+
+    def start_queued(self):
+        while self.queue and sum(1 for peer_id in self.sessions if peer_id is not None) < self.max_sessions:
+            program, peer_id = self.queue.popleft()
+            self.start(program, peer_id, [program, "--connect", peer_id])
+
+    def poll(self):
+        # Returns sessions finished since the last call
+        finished = []
+        for peer_id, session in list(self.sessions.items()):
+            session.returncode = session.process.poll()
+            if session.returncode is not None:
+                del self.sessions[peer_id]
+                finished.append(session)
+        self.finished.extend(finished)
+        self.start_queued()
+        return finished
+
+def read_config(path="config.toml"):
+    # Settings of config.toml, empty if there is no such file
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return toml.load(f)
+    except FileNotFoundError:
+        return {}
+
+def iter_peer_files(folder):
+    # Yields file names of *.toml files of a peers folder with their (size, mtime)
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".toml"):
+                stat = entry.stat()
+                yield entry.name, (stat.st_size, stat.st_mtime_ns)
+
+def peer_sources(folders, folder_stats, peer_ids):
+    # Source folder of each of peer_ids by folder_stats of folder -> {file name: (size, mtime)}.
+    # The newest file wins, on equal mtime the folder listed first. IDs found nowhere are left out.
+    result = {}
+    for peer_id in peer_ids:
+        filename = peer_id + ".toml"
+        newest = None
+        for folder in folders:
+            key = folder_stats.get(folder, {}).get(filename)
+            if key is not None and (newest is None or key[1] > newest[1]):
+                newest = (folder, key[1])
+        if newest is not None:
+            result[peer_id] = newest[0]
+    return result
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    # Case-insensitive substring search over short texts by key.
+    # Queries of three and more characters are narrowed down by a trigram index.
+    def __init__(self):
+        self.texts = {}
+        self.grams = {}
+
+    def set(self, key, values):
+        text = "\n".join(value for value in values if value).casefold()
+        if self.texts.get(key) == text:
+            return
+        self.remove(key)
+        self.texts[key] = text
+        for gram in trigrams(text):
+            self.grams.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            keys = self.grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def search(self, query):
+        query = query.casefold()
+        if len(query) < 3:
+            return {key for key, text in self.texts.items() if query in text}
+        postings = sorted((self.grams.get(gram, set()) for gram in trigrams(query)), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return {key for key in candidates if query in self.texts[key]}
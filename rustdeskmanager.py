@@ -6,17 +6,635 @@
 import sys
 import os
 import toml
-import subprocess
 import pickle
+import time
+# Start of the process for the time to interactive, taken before Qt is imported
+STARTED = time.perf_counter()
+from collections import deque
 from PyQt6.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QFileDialog, QListWidget, QLabel,\
-    QTextEdit, QTreeWidget, QTreeWidgetItem, QInputDialog, QGroupBox, QMessageBox, QCheckBox, QAbstractItemView, QTreeWidgetItemIterator,\
-    QFrame
-from PyQt6.QtCore import Qt, QProcess
-from PyQt6.QtGui import QIcon
+    QTextEdit, QTreeView, QListView, QInputDialog, QGroupBox, QMessageBox, QCheckBox, QAbstractItemView,\
+    QFrame, QMenu, QSpinBox, QDialog, QStyledItemDelegate
+from PyQt6 import sip
+from PyQt6.QtCore import Qt, QProcess, QThread, QDeadlineTimer, QTimer, QFileSystemWatcher, pyqtSignal, QAbstractItemModel, QModelIndex, QMimeData,\
+    QByteArray, QDataStream, QIODevice, QAbstractListModel
+from PyQt6.QtGui import QIcon, QFontDatabase, QColor, QKeySequence, QUndoStack, QUndoCommand
+from rustdeskcore import DEFAULT_MAX_SESSIONS, INSTRUMENTATION_ENV, PROFILE_ENV, instrumentation, PeerIndex, TreeStore, TreeNode,\
+    build_tree, SessionLauncher, SearchIndex, iter_peer_files, peer_sources, PeerRecord, is_peer_id, IMPORT_BATCH_SIZE,\
+    TreeImporter, attach_nodes, read_tree, write_tree, tree_format
 
-class MyTreeWidget(QTreeWidget):
-    def __init__(self):
-        super().__init__()
+# Folder events are coalesced until they stop for WATCH_DEBOUNCE_MS,
+# but no longer than WATCH_MAX_DELAY_MS after the first one
+WATCH_DEBOUNCE_MS = 500
+WATCH_MAX_DELAY_MS = 5000
+# Watched folders are also rescanned this often: rewriting a file in place changes
+# its size or mtime, but is not reported as a change of the folder
+WATCH_POLL_MS = 30000
+# Groups leading to search matches are expanded unless there are more of them,
+# or expanding them would show more than SEARCH_EXPAND_ROWS rows
+SEARCH_EXPAND_LIMIT = 500
+SEARCH_EXPAND_ROWS = 2000
+# The first change of the search text is applied at once, further ones while typing
+# at most once in this many milliseconds
+SEARCH_THROTTLE_MS = 100
+# The search index is filled between events in steps of about this many milliseconds,
+# SEARCH_INDEX_BATCH keys at a time
+SEARCH_INDEX_STEP_MS = 10
+SEARCH_INDEX_BATCH = 100
+# "Раскрыть все" expands branches in steps of this many milliseconds
+EXPAND_STEP_MS = 15
+SESSIONS_POLL_MS = 1000
+# Steps of tree edits kept for undo
+UNDO_LIMIT = 100
+# Tree edits touching more separate runs of rows of one parent are shown by one layout change
+LAYOUT_CHANGE_RUNS = 8
+# Closing the window waits this long for folder scans to stop, scans blocked for longer
+# (an unreachable network folder) are detached and left to the end of the process
+SCANNER_CLOSE_WAIT_MS = 1000
+
+class PeersScanner(QThread):
+    # Lists *.toml files of a peers folder off the GUI thread.
+    # Found files are reported in chunks as dicts of file name -> (size, mtime),
+    # scan_finished reports all of them at once.
+    chunk_found = pyqtSignal(object)
+    scan_finished = pyqtSignal(object)
+    scan_failed = pyqtSignal(str)
+    # Scanners detached from their window while still running
+    detached = set()
+
+    def __init__(self, folder, parent=None, chunk_size=500):
+        super().__init__(parent)
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.cancelled = False
+        self.finished.connect(self.deleteLater)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def detach(self):
+        # Unparented and owned by C++, so neither the window nor the exit of Python destroys
+        # the thread while it is still running
+        self.setParent(None)
+        sip.transferto(self, None)
+        PeersScanner.detached.add(self)
+        self.finished.connect(lambda: PeersScanner.detached.discard(self))
+
+    def run(self):
+        stats = {}
+        chunk = {}
+        try:
+            for filename, key in iter_peer_files(self.folder):
+                if self.cancelled:
+                    return
+                chunk[filename] = stats[filename] = key
+                if len(chunk) >= self.chunk_size:
+                    self.chunk_found.emit(chunk)
+                    chunk = {}
+        except OSError as e:
+            self.scan_failed.emit(str(e))
+            return
+        if chunk:
+            self.chunk_found.emit(chunk)
+        if not self.cancelled:
+            self.scan_finished.emit(stats)
+
+class PeerListModel(QAbstractListModel):
+    # Rows of ids_list straight over the list of peer IDs, without a Qt item per peer.
+    # ids are all peer IDs, rows the IDs shown: ids itself, or the IDs of ids found by
+    # the search while set_filter is active.
+    # source(peer_id) gives the number and folder of the source of an ID, or None.
+    # IDs in unplaced are highlighted as missing from the tree.
+    UNPLACED_COLOR = QColor("#fff3c4")
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.ids = []
+        self.rows = self.ids
+        self.matches = None
+        self.unplaced = set()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        peer_id = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return peer_id
+        if role == Qt.ItemDataRole.BackgroundRole:
+            return self.UNPLACED_COLOR if peer_id in self.unplaced else None
+        if role == Qt.ItemDataRole.UserRole:
+            source = self.source(peer_id)
+            return source[0] if source is not None else None
+        if role == Qt.ItemDataRole.ToolTipRole:
+            source = self.source(peer_id)
+            lines = [os.path.normpath(source[1])] if source is not None else []
+            if peer_id in self.unplaced:
+                lines.append("Нет в структуре")
+            return "\n".join(lines) or None
+        return None
+
+    def flags(self, index):
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsDragEnabled
+
+    def clear(self):
+        self.beginResetModel()
+        self.ids = []
+        self.rows = self.ids
+        self.matches = None
+        self.endResetModel()
+
+    def append_ids(self, ids):
+        if not ids:
+            return
+        shown = ids if self.matches is None else [peer_id for peer_id in ids if peer_id in self.matches]
+        if not shown:
+            self.ids.extend(ids)
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(shown) - 1)
+        if self.rows is not self.ids:
+            self.rows.extend(shown)
+        self.ids.extend(ids)
+        self.endInsertRows()
+
+    def remove_ids(self, removed):
+        # Rows of the IDs in the set removed go in runs of adjacent rows, from the end
+        if self.rows is not self.ids:
+            self.ids[:] = [peer_id for peer_id in self.ids if peer_id not in removed]
+        row = len(self.rows) - 1
+        while row >= 0:
+            if self.rows[row] not in removed:
+                row -= 1
+                continue
+            last = row
+            while row > 0 and self.rows[row - 1] in removed:
+                row -= 1
+            self.beginRemoveRows(QModelIndex(), row, last)
+            del self.rows[row:last + 1]
+            self.endRemoveRows()
+            row -= 1
+
+    def set_filter(self, matches):
+        # Shows the IDs in the set matches only, all of them if matches is None. Rows are
+        # swapped with one layout change, selected rows that stay shown stay selected.
+        if matches is None and self.matches is None:
+            return
+        rows = self.ids if matches is None else [peer_id for peer_id in self.ids if peer_id in matches]
+        if rows == self.rows:
+            self.rows = rows
+            self.matches = matches
+            return
+        self.layoutAboutToBeChanged.emit()
+        old_indexes = self.persistentIndexList()
+        old_ids = [self.rows[index.row()] for index in old_indexes]
+        self.rows = rows
+        self.matches = matches
+        if old_indexes:
+            position = {peer_id: row for row, peer_id in enumerate(rows)}
+            self.changePersistentIndexList(old_indexes, [self.index(position[peer_id]) if peer_id in position else QModelIndex()
+                                                         for peer_id in old_ids])
+        self.layoutChanged.emit()
+
+    def rows_changed(self):
+        # Repaint of all rows after sources or highlighting changed
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1))
+
+class PeerTreeModel(QAbstractItemModel):
+    # Model of id_tree over TreeNode objects. Children of a node become rows only
+    # when its branch is expanded, so the view keeps state for shown rows only.
+    # add_nodes, remove_nodes, move_nodes and rename_node are undoable through undo_stack,
+    # a batch of nodes being one step.
+    nodes_added = pyqtSignal(object)
+    nodes_removed = pyqtSignal(object)
+    node_renamed = pyqtSignal(object, str)
+
+    HEADERS = ["Структура", "Название", "Пользователь", "Компьютер", "Система"]
+    DETAILS_KEYS = ["alias", "username", "hostname", "platform"]
+    NODES_MIME_TYPE = "application/x-rustdeskmanager-nodes"
+    LIST_MIME_TYPE = "application/x-qabstractitemmodeldatalist"
+    ORPHAN_COLOR = QColor("#c0392b")
+    # Asked for every selected row, so combined once
+    NODE_FLAGS = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsDragEnabled | Qt.ItemFlag.ItemIsDropEnabled
+
+    def __init__(self, new_id, details, parent=None):
+        super().__init__(parent)
+        # new_id() gives ids for new nodes, details(text) gives details of a peer ID or None
+        self.new_id = new_id
+        self.details = details
+        self.root = TreeNode(None, "")
+        self.root.fetched = True
+        self.drag_nodes = []
+        self.orphans = set()
+        self.undo_stack = QUndoStack(self)
+        self.undo_stack.setUndoLimit(UNDO_LIMIT)
+
+    def set_root(self, root):
+        self.beginResetModel()
+        root.fetched = True
+        self.root = root
+        self.drag_nodes = []
+        self.undo_stack.clear()
+        self.endResetModel()
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index_of(self, node, column=0):
+        if node is self.root:
+            return QModelIndex()
+        return self.createIndex(node.row(), column, node)
+
+    def index(self, row, column, parent=QModelIndex()):
+        # Called for every shown row on each relayout of the view, so checked here
+        # instead of by hasIndex, which calls rowCount and columnCount back
+        node = parent.internalPointer() if parent.isValid() else self.root
+        if parent.column() > 0 or not node.fetched or not 0 <= row < len(node.children) or not 0 <= column < len(self.HEADERS):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return super().parent()
+        if not index.isValid():
+            return QModelIndex()
+        return self.index_of(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = self.node(parent)
+        return len(node.children) if node.fetched else 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.HEADERS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        return parent.column() <= 0 and bool(self.node(parent).children)
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return not node.fetched and bool(node.children)
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        if node.fetched:
+            return
+        self.beginInsertRows(parent, 0, len(node.children) - 1)
+        node.fetched = True
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role in (Qt.ItemDataRole.ForegroundRole, Qt.ItemDataRole.ToolTipRole):
+            # Leaves in orphans are IDs without a peer file
+            if index.column() != 0 or node.text not in self.orphans or node.children:
+                return None
+            return self.ORPHAN_COLOR if role == Qt.ItemDataRole.ForegroundRole else "Файл *.toml этого ID не найден"
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if index.column() == 0:
+            return node.text
+        details = self.details(node.text)
+        return getattr(details, self.DETAILS_KEYS[index.column() - 1]) if details else None
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.ItemIsDropEnabled
+        return self.NODE_FLAGS
+
+    def columns_changed(self, nodes=None, first_column=1):
+        # Repaint details columns of the nodes, of all shown rows if nodes is None.
+        # first_column=0 repaints the texts as well.
+        if nodes is None:
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node.fetched and node.children:
+                    parent = self.index_of(node)
+                    self.dataChanged.emit(self.index(0, first_column, parent),
+                                          self.index(len(node.children) - 1, len(self.HEADERS) - 1, parent))
+                    stack.extend(node.children)
+            return
+        # One signal per parent over the rows from the first to the last of its nodes,
+        # rows are looked up by one pass over the children, not by row() per node
+        by_parent = {}
+        for node in nodes:
+            if node.parent is not None and node.parent.fetched:
+                by_parent.setdefault(node.parent, set()).add(node)
+        for parent, children in by_parent.items():
+            if len(children) == 1:
+                rows = [next(iter(children)).row()]
+            else:
+                rows = [row for row, child in enumerate(parent.children) if child in children]
+            parent_index = self.index_of(parent)
+            self.dataChanged.emit(self.index(min(rows), first_column, parent_index),
+                                  self.index(max(rows), len(self.HEADERS) - 1, parent_index))
+
+    def shown(self, node):
+        # Views know the rows of the node's children
+        return node.fetched or not node.children
+
+    def insert_nodes(self, parent, row, nodes):
+        if not nodes:
+            return
+        if row < 0 or row > len(parent.children):
+            row = len(parent.children)
+        for node in nodes:
+            node.parent = parent
+        if self.shown(parent):
+            self.beginInsertRows(self.index_of(parent), row, row + len(nodes) - 1)
+            parent.children[row:row] = nodes
+            parent.fetched = True
+            self.endInsertRows()
+        else:
+            parent.children[row:row] = nodes
+
+    def take_nodes(self, nodes):
+        # Detaches the nodes, adjacent rows of a parent are removed at once.
+        # Returns the (parent, row, node) positions to give to put_nodes.
+        by_parent = {}
+        for node in nodes:
+            by_parent.setdefault(node.parent, []).append(node)
+        positions = []
+        for parent, children in by_parent.items():
+            if len(children) == 1:
+                rows = [children[0].row()]
+            else:
+                row_of = {child: row for row, child in enumerate(parent.children)}
+                rows = sorted(row_of[node] for node in children)
+            positions.extend((parent, row, parent.children[row]) for row in rows)
+            runs = self.runs(rows)
+            if parent.fetched and len(runs) > LAYOUT_CHANGE_RUNS:
+                taken = set(children)
+                self.change_children(parent, [child for child in parent.children if child not in taken])
+                continue
+            parent_index = self.index_of(parent) if parent.fetched else None
+            # The last run first, so the rows before keep their numbers
+            for first, last in reversed(runs):
+                if parent_index is not None:
+                    self.beginRemoveRows(parent_index, first, last)
+                del parent.children[first:last + 1]
+                if parent_index is not None:
+                    self.endRemoveRows()
+            for node in children:
+                node.parent = None
+        return positions
+
+    def put_nodes(self, positions):
+        # Puts nodes taken by take_nodes back in place, adjacent rows at once
+        by_parent = {}
+        for parent, row, node in positions:
+            by_parent.setdefault(parent, []).append((row, node))
+        for parent, rows in by_parent.items():
+            runs = self.runs([row for row, _ in rows])
+            if parent.fetched and len(runs) > LAYOUT_CHANGE_RUNS:
+                children = list(parent.children)
+                for row, node in rows:
+                    node.parent = parent
+                    children.insert(row, node)
+                self.change_children(parent, children)
+                continue
+            start = 0
+            for first, last in runs:
+                self.insert_nodes(parent, first, [node for _, node in rows[start:start + last - first + 1]])
+                start += last - first + 1
+
+    @staticmethod
+    def runs(rows):
+        # (first, last) of the runs of adjacent rows of sorted rows
+        runs = []
+        for row in rows:
+            if runs and runs[-1][1] == row - 1:
+                runs[-1][1] = row
+            else:
+                runs.append([row, row])
+        return runs
+
+    def change_children(self, parent, children):
+        # Replaces the children of a shown node with one layout change instead of a signal
+        # per run of rows. Indexes of removed nodes and of their descendants become invalid.
+        self.layoutAboutToBeChanged.emit()
+        kept = set(children)
+        for child in parent.children:
+            if child not in kept:
+                child.parent = None
+        parent.children[:] = children
+        rows = {child: row for row, child in enumerate(children)}
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            node = index.internalPointer()
+            if node.parent is parent:
+                new_indexes.append(self.createIndex(rows[node], index.column(), node))
+            elif self.attached(node):
+                new_indexes.append(index)
+            else:
+                new_indexes.append(QModelIndex())
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def attached(self, node):
+        while node is not None and node is not self.root:
+            node = node.parent
+        return node is self.root
+
+    @staticmethod
+    def outermost(nodes):
+        # The nodes without those contained in another one of them
+        nodes = list(dict.fromkeys(nodes))
+        contained = set(nodes)
+        return [node for node in nodes if not contained.intersection(node.ancestors())]
+
+    def add_nodes(self, parent, row, nodes):
+        if nodes:
+            self.undo_stack.push(AddNodesCommand(self, parent, row, nodes))
+
+    def remove_nodes(self, nodes):
+        nodes = self.outermost(nodes)
+        if nodes:
+            self.undo_stack.push(RemoveNodesCommand(self, nodes))
+
+    def rename_node(self, node, text):
+        if text != node.text:
+            self.undo_stack.push(RenameNodeCommand(self, node, text))
+
+    def set_text(self, node, text):
+        old_text = node.text
+        node.text = text
+        if node.parent.fetched:
+            index = self.index_of(node)
+            self.dataChanged.emit(index, index)
+        self.node_renamed.emit(node, old_text)
+
+    def move_nodes(self, nodes, parent, row=-1):
+        # Nodes containing the target and nodes moved along with an ancestor are skipped
+        targets = {parent} | set(parent.ancestors())
+        nodes = [node for node in self.outermost(nodes) if node not in targets]
+        if nodes:
+            self.undo_stack.push(MoveNodesCommand(self, nodes, parent, row))
+
+    def copy_node(self, node):
+        copy = TreeNode(self.new_id(), node.text)
+        for child in node.children:
+            child_copy = self.copy_node(child)
+            child_copy.parent = copy
+            copy.children.append(child_copy)
+        return copy
+
+    def supportedDropActions(self):
+        return Qt.DropAction.MoveAction | Qt.DropAction.CopyAction
+
+    def mimeTypes(self):
+        return [self.NODES_MIME_TYPE, self.LIST_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        # Dragged nodes stay in the model, the mime data only marks the drag as internal
+        self.drag_nodes = []
+        for index in indexes:
+            if index.column() == 0 and index.internalPointer() not in self.drag_nodes:
+                self.drag_nodes.append(index.internalPointer())
+        data = QMimeData()
+        data.setData(self.NODES_MIME_TYPE, QByteArray())
+        data.setText("\n".join(node.text for node in self.drag_nodes))
+        return data
+
+    def dropMimeData(self, data, action, row, column, parent):
+        parent_node = self.node(parent)
+        if data.hasFormat(self.NODES_MIME_TYPE):
+            if action == Qt.DropAction.MoveAction:
+                self.move_nodes(self.drag_nodes, parent_node, row)
+            elif action == Qt.DropAction.CopyAction:
+                self.add_nodes(parent_node, row, [self.copy_node(node) for node in self.drag_nodes])
+            else:
+                return False
+            return True
+        if data.hasFormat(self.LIST_MIME_TYPE):
+            # Items dragged from ids_list, encoded by QAbstractItemModel.mimeData
+            texts = []
+            encoded = data.data(self.LIST_MIME_TYPE)
+            stream = QDataStream(encoded, QIODevice.OpenModeFlag.ReadOnly)
+            while not stream.atEnd():
+                stream.readInt32()
+                stream.readInt32()
+                for _ in range(stream.readInt32()):
+                    role = stream.readInt32()
+                    value = stream.readQVariant()
+                    if role == Qt.ItemDataRole.DisplayRole:
+                        texts.append(value)
+            self.add_nodes(parent_node, row, [TreeNode(self.new_id(), text) for text in texts])
+            return True
+        return False
+
+class AddNodesCommand(QUndoCommand):
+    def __init__(self, model, parent, row, nodes):
+        super().__init__(f"Добавить {len(nodes)}" if len(nodes) > 1 else f"Добавить {nodes[0].text}")
+        self.model = model
+        self.parent = parent
+        self.row = row
+        self.nodes = nodes
+
+    def redo(self):
+        self.model.insert_nodes(self.parent, self.row, self.nodes)
+        self.model.nodes_added.emit([added for node in self.nodes for added in node.walk()])
+
+    def undo(self):
+        self.model.take_nodes(self.nodes)
+        self.model.nodes_removed.emit([removed for node in self.nodes for removed in node.walk()])
+
+class RemoveNodesCommand(QUndoCommand):
+    def __init__(self, model, nodes):
+        super().__init__(f"Удалить {len(nodes)}" if len(nodes) > 1 else f"Удалить {nodes[0].text}")
+        self.model = model
+        self.nodes = nodes
+        self.positions = []
+
+    def redo(self):
+        self.positions = self.model.take_nodes(self.nodes)
+        self.model.nodes_removed.emit([removed for node in self.nodes for removed in node.walk()])
+
+    def undo(self):
+        self.model.put_nodes(self.positions)
+        self.model.nodes_added.emit([added for node in self.nodes for added in node.walk()])
+
+class MoveNodesCommand(QUndoCommand):
+    def __init__(self, model, nodes, parent, row):
+        super().__init__(f"Переместить {len(nodes)}" if len(nodes) > 1 else f"Переместить {nodes[0].text}")
+        self.model = model
+        self.nodes = nodes
+        self.parent = parent
+        self.row = row
+        self.positions = []
+
+    def redo(self):
+        row = self.row
+        if row < 0 or row > len(self.parent.children):
+            row = len(self.parent.children)
+        self.positions = self.model.take_nodes(self.nodes)
+        row -= sum(1 for parent, taken_row, _ in self.positions if parent is self.parent and taken_row < row)
+        self.model.insert_nodes(self.parent, row, self.nodes)
+
+    def undo(self):
+        self.model.take_nodes(self.nodes)
+        self.model.put_nodes(self.positions)
+
+class RenameNodeCommand(QUndoCommand):
+    def __init__(self, model, node, text):
+        super().__init__(f"Переименовать {node.text}")
+        self.model = model
+        self.node = node
+        self.text = text
+
+    def redo(self):
+        # Swaps the text of the node with the kept one, so undo is the same
+        self.text, text = self.node.text, self.text
+        self.model.set_text(self.node, text)
+
+    def undo(self):
+        self.redo()
+
+class MyTreeView(QTreeView):
+    def dropEvent(self, event):
+        # Drops are applied by the model. The drag source is told the data was copied,
+        # so neither ids_list nor this view removes the dragged rows afterwards.
+        index = self.indexAt(event.position().toPoint())
+        position = self.dropIndicatorPosition()
+        if not index.isValid() or position == QAbstractItemView.DropIndicatorPosition.OnViewport:
+            parent, row = QModelIndex(), -1
+        elif position == QAbstractItemView.DropIndicatorPosition.OnItem:
+            parent, row = index, -1
+        elif position == QAbstractItemView.DropIndicatorPosition.AboveItem:
+            parent, row = index.parent(), index.row()
+        else:
+            parent, row = index.parent(), index.row() + 1
+        if event.source() is self and not event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            action = Qt.DropAction.MoveAction
+        else:
+            action = Qt.DropAction.CopyAction
+        if self.model().dropMimeData(event.mimeData(), action, row, 0, parent):
+            event.setDropAction(Qt.DropAction.CopyAction)
+            event.accept()
+        else:
+            event.ignore()
+        self.setState(QAbstractItemView.State.NoState)
+        self.viewport().update()
+
+class PeerSourceDelegate(QStyledItemDelegate):
+    # Shows the source number of ids_list rows after the ID, the row data stays the ID
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        source = index.data(Qt.ItemDataRole.UserRole)
+        if source:
+            option.text = f"{option.text}  [{source}]"
 
 class MyPushButton(QPushButton):
     def __init__(self):
@@ -24,18 +642,188 @@ class MyPushButton(QPushButton):
     
         self.setStyleSheet("QPushButton:hover { background-color: #ccc; }")
 
+class StatsDialog(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Статистика производительности")
+        self.resize(900, 400)
+        layout = QVBoxLayout()
+        self.text = QTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.text)
+
+        button_layout = QHBoxLayout()
+        refresh_button = MyPushButton()
+        refresh_button.setText("Обновить")
+        refresh_button.clicked.connect(self.refresh)
+        reset_button = MyPushButton()
+        reset_button.setText("Сбросить")
+        reset_button.clicked.connect(self.reset)
+        dump_button = MyPushButton()
+        dump_button.setText("Сохранить JSON...")
+        dump_button.setToolTip("Сохранить статистику в файл JSON для отчёта об ошибке")
+        dump_button.clicked.connect(self.dump)
+        self.profile_button = MyPushButton()
+        self.profile_button.clicked.connect(self.toggle_profile)
+        button_layout.addWidget(refresh_button)
+        button_layout.addWidget(reset_button)
+        button_layout.addWidget(dump_button)
+        button_layout.addWidget(self.profile_button)
+        button_layout.addStretch()
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+        self.refresh()
+
+    def refresh(self):
+        self.text.setPlainText(instrumentation.report())
+        if instrumentation.profiler is None:
+            self.profile_button.setText("Начать профилирование")
+            self.profile_button.setToolTip("Записывать профиль cProfile до остановки")
+        else:
+            self.profile_button.setText("Остановить профилирование...")
+            self.profile_button.setToolTip("Остановить запись и сохранить профиль cProfile (*.prof)")
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
+
+    def dump(self):
+        path = QFileDialog.getSaveFileName(self, "Сохранить статистику", "rustdeskmanager-stats.json", "JSON (*.json)")[0]
+        if path:
+            try:
+                instrumentation.dump(path)
+            except OSError as e:
+                QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить {path}:\n{e}")
+
+    def toggle_profile(self):
+        if instrumentation.profiler is None:
+            instrumentation.start_profile()
+        else:
+            path = QFileDialog.getSaveFileName(self, "Сохранить профиль", "rustdeskmanager.prof", "cProfile (*.prof)")[0]
+            try:
+                instrumentation.stop_profile(path)
+            except OSError as e:
+                QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить {path}:\n{e}")
+        self.refresh()
+
 class RustDeskManager(QWidget):
-    def __init__(self):
+    def __init__(self, started=STARTED):
         super().__init__()
 
         self.work_folder_path = ""
         self.rustdesk_path = ""
-        self.ids = []
+        self.peer_index = PeerIndex()
+        self.peer_index.load()
+        # Peer sources: the work folder and extra folders, scanned each by its own PeersScanner
+        self.extra_folder_paths = []
+        self.scanners = {}
+        self.folder_stats = {}
+        self.failed_folders = set()
+        self.watch_scanners = {}
+        # Every PeersScanner still running, also those cancelled by a restart of the scan
+        self.live_scanners = set()
+        self.watch_pending = set()
+        self.watch_first_event = 0
+        # Source folder of every peer ID of ids_list, known_ids is a view of its keys
+        self.peer_sources = {}
+        self.known_ids = self.peer_sources.keys()
+        # Texts of id_tree nodes mapped to their nodes
+        self.tree_items = {}
+        # Kept up to date from the peer list, the tree and the details. Keys in search_pending
+        # are indexed between events by index_search_step, so a search only queries the index.
+        self.search_index = SearchIndex()
+        self.search_pending = set()
+        self.search_index_timer = QTimer(self)
+        self.search_index_timer.timeout.connect(self.index_search_step)
+        # Matched keys and the ancestors of matching nodes while the tree is filtered. tree_hidden are the nodes
+        # whose rows were hidden by the filter, None after a layout change made it unknown.
+        self.tree_filter = None
+        self.tree_hidden = set()
+        # Leaf IDs of id_tree without a peer file and peer IDs missing from id_tree,
+        # kept up to date by update_reconciliation
+        self.orphan_ids = set()
+        self.unplaced_ids = set()
+        self.expand_queue = deque()
+        self.tree_store = TreeStore()
+        self.launcher = SessionLauncher()
+        self.scan_started = 0
+        self.stats_dialog = None
+        # Fast start: the peer list of the last run is shown at once from peers.json, folders
+        # are rescanned once the first frame is painted, see start_deferred
+        self.started = started
+        self.painted = False
+        self.deferred_load = False
+        self.startup_rescans = set()
+        self.time_to_first_paint = None
+        self.time_to_interactive = None
+        # With fast start only the top level of the tree is shown until start_deferred loads all of it,
+        # the tree is not saved before
+        self.tree_loaded = False
+        self.time_to_tree_loaded = None
         self.init_ui()
 
     def showEvent(self, event):
         super().showEvent(event)
-        self.item_value_update()
+        # With fast start details are refreshed after the first paint
+        if not self.fast_start_checkbox.isChecked():
+            self.item_value_update()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            QTimer.singleShot(0, self.start_deferred)
+
+    def start_deferred(self):
+        # First return to the event loop after the first paint
+        self.time_to_first_paint = (time.perf_counter() - self.started) * 1000
+        instrumentation.record("time_to_first_paint", self.time_to_first_paint)
+        if not self.tree_loaded:
+            self.load_tree()
+            self.time_to_tree_loaded = (time.perf_counter() - self.started) * 1000
+            instrumentation.record("time_to_tree_loaded", self.time_to_tree_loaded)
+        self.reconcile()
+        if self.startup_rescans:
+            self.scan_started = time.perf_counter()
+            self.watch_pending.update(self.startup_rescans)
+            self.rescan_work_folder()
+        elif self.deferred_load:
+            self.load_ids()
+        # The window is usable once the work above has returned to the event loop
+        QTimer.singleShot(0, self.mark_interactive)
+
+    def mark_interactive(self):
+        self.time_to_interactive = (time.perf_counter() - self.started) * 1000
+        instrumentation.record("time_to_interactive", self.time_to_interactive)
+        self.update_ids_tooltip()
+
+    def restore_peers(self):
+        # Shows the peers of the folder listings saved by the last run, if all folders have one.
+        # They are checked by startup_rescans like changes of watched folders.
+        folders = self.peer_folders()
+        if not folders or any(folder not in self.peer_index.folders for folder in folders):
+            return False
+        with instrumentation.timer("restore_peers"):
+            self.folder_stats = {folder: self.peer_index.folders[folder] for folder in folders}
+            self.update_folder_watcher()
+            peer_ids = list(dict.fromkeys(sys.intern(os.path.splitext(filename)[0])
+                                          for stats in self.folder_stats.values() for filename in stats))
+            # Straight into the list, reconciliation follows in start_deferred
+            self.peer_sources.update(peer_sources(folders, self.folder_stats, peer_ids))
+            self.ids_model.append_ids(peer_ids)
+            self.queue_search_entries(peer_ids)
+            self.startup_rescans = set(folders)
+        return True
+
+    def startup_rescan_done(self, folder):
+        if folder not in self.startup_rescans:
+            return
+        self.startup_rescans.discard(folder)
+        if not self.startup_rescans:
+            instrumentation.record("startup_rescan", (time.perf_counter() - self.scan_started) * 1000)
+            self.item_value_update()
 
 
     def init_ui(self):
@@ -81,6 +869,53 @@ class RustDeskManager(QWidget):
         settings_layout.addWidget(self.work_folder_label)
         settings_layout.addLayout(work_folder_layout)
 
+        # Extra peer sources
+        extra_folders_layout = QHBoxLayout()
+        extra_folders_button_layout = QVBoxLayout()
+        self.extra_folders_label = QLabel("Дополнительные папки с файлами *.toml (другие профили, сетевые папки):")
+        self.extra_folders_list = QListWidget()
+        self.extra_folders_list.setFixedSize(400, 60)
+        self.extra_folders_list.setToolTip("ID из всех папок показываются в одном списке, рядом с ID указан номер папки.\n"
+                                           "Если ID есть в нескольких папках, используется самый новый файл,\n"
+                                           "при равном времени изменения — из папки выше по списку (основная папка первая)")
+        self.add_folder_button = MyPushButton()
+        self.add_folder_button.setText("Добавить")
+        self.add_folder_button.setFixedWidth(80)
+        self.add_folder_button.clicked.connect(self.add_extra_folder)
+        self.remove_folder_button = MyPushButton()
+        self.remove_folder_button.setText("Удалить")
+        self.remove_folder_button.setFixedWidth(80)
+        self.remove_folder_button.clicked.connect(self.remove_extra_folder)
+        extra_folders_button_layout.addWidget(self.add_folder_button)
+        extra_folders_button_layout.addWidget(self.remove_folder_button)
+        extra_folders_layout.addWidget(self.extra_folders_list)
+        extra_folders_layout.addLayout(extra_folders_button_layout)
+        extra_folders_layout.addStretch()
+        settings_layout.addWidget(self.extra_folders_label)
+        settings_layout.addLayout(extra_folders_layout)
+
+        # Watching the work folder
+        self.watch_checkbox = QCheckBox("Отслеживать изменения в папке")
+        self.watch_checkbox.setToolTip("Добавленные, удалённые и изменённые файлы *.toml применяются к списку и структуре автоматически.\n"
+                                       f"Изменения содержимого файлов проверяются раз в {WATCH_POLL_MS // 1000} с")
+        self.watch_checkbox.toggled.connect(self.watch_checkbox_toggled)
+        settings_layout.addWidget(self.watch_checkbox)
+
+        self.fast_start_checkbox = QCheckBox("Быстрый запуск")
+        self.fast_start_checkbox.setChecked(True)
+        self.fast_start_checkbox.setToolTip("При запуске список ID и описания показываются из кэша прошлого запуска,\n"
+                                            "папки проверяются и описания обновляются сразу после открытия окна")
+        settings_layout.addWidget(self.fast_start_checkbox)
+        self.folder_watcher = QFileSystemWatcher(self)
+        self.folder_watcher.directoryChanged.connect(self.work_folder_changed)
+        self.watch_timer = QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(WATCH_DEBOUNCE_MS)
+        self.watch_timer.timeout.connect(self.rescan_work_folder)
+        self.watch_poll_timer = QTimer(self)
+        self.watch_poll_timer.setInterval(WATCH_POLL_MS)
+        self.watch_poll_timer.timeout.connect(self.poll_work_folders)
+
         # Rustdesk path
         rustdesk_layout = QHBoxLayout()
         self.rustdesk_label = QLabel("Путь к исполняемому файлу Rustdesk:")
@@ -105,30 +940,75 @@ class RustDeskManager(QWidget):
         settings_layout.addWidget(self.rustdesk_label)
         settings_layout.addLayout(rustdesk_layout)
 
+        # Concurrent connections
+        max_sessions_layout = QHBoxLayout()
+        self.max_sessions_label = QLabel("Одновременных подключений:")
+        self.max_sessions_input = QSpinBox()
+        self.max_sessions_input.setRange(1, 64)
+        self.max_sessions_input.setValue(DEFAULT_MAX_SESSIONS)
+        self.max_sessions_input.setToolTip("Остальные выбранные ID ждут в очереди, пока не завершится одно из подключений")
+        self.max_sessions_input.valueChanged.connect(self.max_sessions_changed)
+        max_sessions_layout.addWidget(self.max_sessions_label)
+        max_sessions_layout.addWidget(self.max_sessions_input)
+        max_sessions_layout.addStretch()
+        settings_layout.addLayout(max_sessions_layout)
+
+        # Instrumentation
+        instrumentation_layout = QHBoxLayout()
+        self.instrumentation_checkbox = QCheckBox("Собирать статистику производительности")
+        self.instrumentation_checkbox.setToolTip("Число вызовов и время загрузки, чтения *.toml, сохранения и запуска Rustdesk.\n"
+                                                 f"Также включается переменной окружения {INSTRUMENTATION_ENV}=1")
+        self.instrumentation_checkbox.toggled.connect(self.instrumentation_checkbox_toggled)
+        self.stats_button = MyPushButton()
+        self.stats_button.setText("Статистика...")
+        self.stats_button.setFixedWidth(100)
+        self.stats_button.setEnabled(instrumentation.enabled)
+        self.stats_button.clicked.connect(self.show_stats)
+        instrumentation_layout.addWidget(self.instrumentation_checkbox)
+        instrumentation_layout.addWidget(self.stats_button)
+        instrumentation_layout.addStretch()
+        settings_layout.addLayout(instrumentation_layout)
+
         # Add settings layout to settings frame
         settings_frame.setLayout(settings_layout)
         layout.addWidget(settings_frame)
 
         # IDs list
         self.ids_label = QLabel("Rustdesk IDs (*.toml):")
-        self.ids_list = QListWidget()
+        self.ids_model = PeerListModel(self.peer_source, self)
+        self.ids_list = QListView()
+        self.ids_list.setModel(self.ids_model)
+        self.ids_list.setUniformItemSizes(True)
         self.ids_list.setMaximumWidth(150)
         self.ids_list.setDragEnabled(True)
-        self.ids_list.setToolTip(f"Можно выделить элемент и перетащить в структуру.\nМожно выделить несколько элементов и перетащить в структуру.\nКнопка Rustdesk сейчас работает только для этого списка!")
+        self.ids_list.setToolTip(f"Можно выделить элемент и перетащить в структуру.\nМожно выделить несколько элементов и перетащить в структуру.\nКонтекстное меню позволяет найти ID в структуре.\nКнопка Rustdesk сейчас работает только для этого списка!")
         self.ids_list.setDragDropMode(QAbstractItemView.DragDropMode.DragOnly)
         self.ids_list.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
         self.ids_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
-        self.ids_list.currentRowChanged.connect(self.ids_list_selection_changed)
+        self.ids_list.selectionModel().currentChanged.connect(self.ids_list_selection_changed)
         self.ids_list.clicked.connect(self.ids_list_selection_changed)
-        self.ids_list.itemDoubleClicked.connect(self.run_rustdesk)
+        self.ids_list.doubleClicked.connect(self.run_rustdesk)
+        self.ids_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.ids_list.customContextMenuRequested.connect(self.ids_list_context_menu)
+        self.ids_list.setItemDelegate(PeerSourceDelegate(self.ids_list))
 
         # Run button
         self.run_button = MyPushButton()
         self.run_button.setText("Rustdesk...")
-        self.run_button.setToolTip("Запустить rustdesk.exe для выбранного ID (rustdesk.exe --connect ID)")
+        self.run_button.setToolTip("Запустить rustdesk.exe для выбранных ID (rustdesk.exe --connect ID)")
         self.run_button.clicked.connect(self.run_rustdesk)
         self.run_button.setDefault(True)
 
+        # Sessions
+        self.sessions_label = QLabel("Сеансы:")
+        self.sessions_list = QListWidget()
+        self.sessions_list.setMaximumWidth(150)
+        self.sessions_list.setMaximumHeight(80)
+        self.sessions_list.setToolTip("Запущенные и ожидающие подключения")
+        self.sessions_timer = QTimer(self)
+        self.sessions_timer.setInterval(SESSIONS_POLL_MS)
+        self.sessions_timer.timeout.connect(self.poll_sessions)
+
         # Details
         self.details_label = QLabel("Описание:")
 
@@ -140,17 +1020,37 @@ class RustDeskManager(QWidget):
         self.details_text.setStyleSheet("background-color: #f0f0f0;")
 
         # Group tree
-        self.id_tree = MyTreeWidget()
-        self.id_tree.setHeaderLabels(["Структура", "Название", "Пользователь", "Компьютер", "Система"])
+        self.tree_model = PeerTreeModel(self.tree_store.new_id, self.cached_details, self)
+        self.tree_model.nodes_added.connect(self.tree_nodes_added)
+        self.tree_model.nodes_removed.connect(self.tree_nodes_removed)
+        self.tree_model.node_renamed.connect(self.tree_node_renamed)
+        self.tree_model.modelReset.connect(self.rebuild_tree_index)
+        self.tree_model.layoutChanged.connect(self.tree_layout_changed)
+        self.id_tree = MyTreeView()
+        self.id_tree.setModel(self.tree_model)
+        self.tree_model.rowsInserted.connect(self.tree_rows_inserted)
         self.id_tree.setDragDropMode(QAbstractItemView.DragDropMode.DragDrop)
+        self.id_tree.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.id_tree.setDragEnabled(True)
         self.id_tree.setDropIndicatorShown(True)
         self.id_tree.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
         self.id_tree.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
         self.id_tree.setColumnWidth(0, 200)
-        self.id_tree.itemDoubleClicked.connect(self.run_rustdesk)
-        self.id_tree.currentItemChanged.connect(self.tree_selection_changed)
+        # Rows are never measured one by one, also on relayout after batched edits
+        self.id_tree.setUniformRowHeights(True)
+        self.id_tree.doubleClicked.connect(self.run_rustdesk)
+        self.id_tree.selectionModel().currentChanged.connect(self.tree_selection_changed)
         self.id_tree.clicked.connect(self.tree_selection_changed)
+        self.id_tree.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.id_tree.customContextMenuRequested.connect(self.id_tree_context_menu)
+        # Undo and redo of tree edits, shortcuts work in the whole window
+        self.undo_action = self.tree_model.undo_stack.createUndoAction(self, "Отменить")
+        self.undo_action.setShortcut(QKeySequence.StandardKey.Undo)
+        self.redo_action = self.tree_model.undo_stack.createRedoAction(self, "Повторить")
+        self.redo_action.setShortcut(QKeySequence.StandardKey.Redo)
+        self.addActions([self.undo_action, self.redo_action])
+        self.expand_timer = QTimer(self)
+        self.expand_timer.timeout.connect(self.expand_step)
 
         # Create checkbox for expanding/collapsing tree
         create_checkbox = QCheckBox("Expand all")
@@ -158,6 +1058,15 @@ class RustDeskManager(QWidget):
         create_checkbox.setText("Раскрыть все")
         create_checkbox.stateChanged.connect(self.expand_all_checkbox_changed)
 
+        # Orphans and unplaced IDs
+        self.reconcile_checkbox = QCheckBox("Показать расхождения")
+        self.reconcile_checkbox.setToolTip("Выделить красным ID структуры без файла *.toml\nи жёлтым ID списка, которых нет в структуре")
+        self.reconcile_checkbox.toggled.connect(self.reconcile_checkbox_toggled)
+        self.reconcile_button = MyPushButton()
+        self.reconcile_button.setText("Сверка")
+        self.reconcile_button.setToolTip("ID структуры без файла / ID списка не в структуре")
+        self.reconcile_button.clicked.connect(self.show_reconcile_menu)
+
         # Add buttons to create, rename, move, and delete groups
         create_button = MyPushButton()
         create_button.setText("Создать")
@@ -173,15 +1082,27 @@ class RustDeskManager(QWidget):
         
         delete_button = MyPushButton()
         delete_button.setText("Удалить")
-        delete_button.setToolTip("Удалить группу или элемент")
+        delete_button.setToolTip("Удалить выбранные группы или элементы")
         delete_button.clicked.connect(self.delete_group)
         delete_button.setMaximumWidth(100)
 
-        update_button = MyPushButton()
-        update_button.setText("Обновить")
-        update_button.setToolTip("Обновить название, пользователь, компьютер, система")
-        update_button.clicked.connect(self.item_value_update)
-        update_button.setMaximumWidth(100)
+        self.update_button = MyPushButton()
+        self.update_button.setText("Обновить")
+        self.update_button.setToolTip("Обновить название, пользователь, компьютер, система")
+        self.update_button.clicked.connect(self.item_value_update)
+        self.update_button.setMaximumWidth(100)
+
+        import_button = MyPushButton()
+        import_button.setText("Импорт...")
+        import_button.setToolTip("Загрузить структуру из файла JSON или CSV (путь группы, ID)")
+        import_button.clicked.connect(self.import_tree)
+        import_button.setMaximumWidth(100)
+
+        export_button = MyPushButton()
+        export_button.setText("Экспорт...")
+        export_button.setToolTip("Сохранить структуру в файл JSON или CSV (путь группы, ID)")
+        export_button.clicked.connect(self.export_tree)
+        export_button.setMaximumWidth(100)
         
         # Add buttons to tree layout
         tree_button_layout.addWidget(create_button)
@@ -190,11 +1111,19 @@ class RustDeskManager(QWidget):
         tree_button_layout.addSpacing(1)
         tree_button_layout.addWidget(delete_button)
         tree_button_layout.addSpacing(1)
-        tree_button_layout.addWidget(update_button)
+        tree_button_layout.addWidget(self.update_button)
         tree_button_layout.addStretch()
+        tree_button_layout.addWidget(import_button)
+        tree_button_layout.addSpacing(1)
+        tree_button_layout.addWidget(export_button)
 
         # Add tree layout to tree frame
-        tree_layout.addWidget(create_checkbox)
+        tree_options_layout = QHBoxLayout()
+        tree_options_layout.addWidget(create_checkbox)
+        tree_options_layout.addWidget(self.reconcile_checkbox)
+        tree_options_layout.addStretch()
+        tree_options_layout.addWidget(self.reconcile_button)
+        tree_layout.addLayout(tree_options_layout)
         tree_layout.addWidget(self.id_tree)
         tree_layout.addLayout(tree_button_layout)
 
@@ -202,6 +1131,8 @@ class RustDeskManager(QWidget):
         IDs_layout.addWidget(self.ids_label)
         IDs_layout.addWidget(self.ids_list)
         IDs_layout.addWidget(self.run_button)
+        IDs_layout.addWidget(self.sessions_label)
+        IDs_layout.addWidget(self.sessions_list)
 
         # Add layouts to horizontal layout
         horizontal_layout.addLayout(IDs_layout)
@@ -211,6 +1142,19 @@ class RustDeskManager(QWidget):
         horizontal_line.setFrameShape(QFrame.Shape.HLine)
         horizontal_line.setFrameShadow(QFrame.Shadow.Sunken)
 
+        # Search
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Поиск: ID, название, пользователь, компьютер, система")
+        self.search_input.setToolTip("Оставляет в списке и структуре только совпадения по части текста")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_THROTTLE_MS)
+        self.search_timer.timeout.connect(self.search_timer_timeout)
+        self.search_changed = False
+        self.search_input.textChanged.connect(self.search_text_changed)
+
+        layout.addWidget(self.search_input)
         layout.addLayout(horizontal_layout)
         layout.addSpacing(15)
         layout.addWidget(horizontal_line)
@@ -223,86 +1167,397 @@ class RustDeskManager(QWidget):
 
 
 
-    ########For QTreeWidget Start###############
+    ########For QTreeView Start###############
     def expand_all_checkbox_changed(self, state):
+        # Branches are expanded in small steps between events, children are fetched on expansion
+        self.expand_queue.clear()
         if state == Qt.CheckState.Checked.value:
-            self.id_tree.expandAll()
+            self.expand_queue.extend(node for node in self.tree_model.root.children if node.children)
+            self.expand_timer.start()
         else:
+            self.expand_timer.stop()
             self.id_tree.collapseAll()
 
+    def expand_step(self):
+        deadline = time.perf_counter() + EXPAND_STEP_MS / 1000
+        while self.expand_queue and time.perf_counter() < deadline:
+            node = self.expand_queue.popleft()
+            if node.parent is None:
+                continue
+            self.id_tree.expand(self.tree_model.index_of(node))
+            self.expand_queue.extend(child for child in node.children if child.children)
+        if not self.expand_queue:
+            self.expand_timer.stop()
+
+    def current_node(self):
+        index = self.id_tree.currentIndex()
+        return self.tree_model.node(index) if index.isValid() else None
+
     def create_group(self):
-        selected_item = self.id_tree.currentItem()
-        if selected_item:
+        selected_node = self.current_node()
+        if selected_node:
             group_name, ok = QInputDialog.getText(self, "Создание группы/элемента", "Введите имя группы/элемента:")
-            if ok:
-                group = QTreeWidgetItem([group_name])
-                group.setFlags(group.flags() | Qt.ItemFlag.ItemIsSelectable)
-                selected_item.addChild(group)
+            if ok and self.confirm_duplicate(group_name):
+                self.tree_model.add_nodes(selected_node, -1, [TreeNode(self.tree_store.new_id(), group_name)])
         else:
             group_name, ok = QInputDialog.getText(self, "Создание группы/элемента", "Введите имя группы/элемента:")
-            if ok:
-                group = QTreeWidgetItem([group_name])
-                group.setFlags(group.flags() | Qt.ItemFlag.ItemIsSelectable)
-                self.id_tree.addTopLevelItem(group)
+            if ok and self.confirm_duplicate(group_name):
+                self.tree_model.add_nodes(self.tree_model.root, -1, [TreeNode(self.tree_store.new_id(), group_name)])
+
+    def confirm_duplicate(self, name):
+        if name not in self.known_ids or name not in self.tree_items:
+            return True
+        confirm = QMessageBox.question(self, "Повтор ID", f"ID {name} уже есть в структуре. Добавить ещё раз?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        return confirm == QMessageBox.StandardButton.Yes
 
     def rename_group(self):
-        selected_item = self.id_tree.currentItem()
-        if selected_item:
-            new_name, ok = QInputDialog.getText(self, "Переименование группы/элемента", "Введите новое имя группы/элемента:", text=selected_item.text(0))
+        selected_node = self.current_node()
+        if selected_node:
+            new_name, ok = QInputDialog.getText(self, "Переименование группы/элемента", "Введите новое имя группы/элемента:", text=selected_node.text)
             if ok:
-                selected_item.setText(0, new_name)
+                self.tree_model.rename_node(selected_node, new_name)
+
+    def selected_nodes(self):
+        # Selected nodes of id_tree in tree order. Read from the selection ranges,
+        # selectedRows is slow with thousands of separate rows.
+        nodes = set()
+        for selection_range in self.id_tree.selectionModel().selection():
+            parent = self.tree_model.node(selection_range.parent())
+            nodes.update(parent.children[selection_range.top():selection_range.bottom() + 1])
+        rows = {}
+        def position(node):
+            path = []
+            for ancestor in [node, *node.ancestors()]:
+                parent = ancestor.parent
+                if parent not in rows:
+                    rows[parent] = {child: row for row, child in enumerate(parent.children)}
+                path.append(rows[parent][ancestor])
+            return path[::-1]
+        return sorted(nodes, key=position)
 
     def delete_group(self):
-        selected_item = self.id_tree.currentItem()
-        if selected_item:
-            confirm = QMessageBox.question(self, "Удалить группу", f"Вы уверены, что хотите удалить {selected_item.text(0)}?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
-            if confirm == QMessageBox.StandardButton.Yes:
-                parent = selected_item.parent()
-                parent_count = self.id_tree.topLevelItemCount()
-                if parent is None:
-                    # remove the item from the tree
-                    if parent_count > 1:
-                        self.id_tree.currentItem().removeChild(selected_item)
-                    else:
-                        QMessageBox.warning(self, "Удаление группы", "Нельзя удалить единственную группу верхнего уровня.")
-                        pass
-                else:
-                    for child in range(selected_item.childCount()):
-                        child_item = selected_item.child(child)
-                        parent.addChild(child_item)
-                    parent.removeChild(selected_item)
+        # Top level groups are removed with their contents, other groups leave their
+        # children to their parent. All selected nodes are one undo step.
+        nodes = self.selected_nodes()
+        if not nodes:
+            return
+        name = nodes[0].text if len(nodes) == 1 else f"выбранные элементы ({len(nodes)})"
+        confirm = QMessageBox.question(self, "Удалить группу", f"Вы уверены, что хотите удалить {name}?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if confirm != QMessageBox.StandardButton.Yes:
+            return
+        root = self.tree_model.root
+        if set(root.children) <= set(nodes):
+            QMessageBox.warning(self, "Удаление группы", "Нельзя удалить единственную группу верхнего уровня." if len(root.children) == 1
+                                else "Нельзя удалить все группы верхнего уровня.")
+            return
+        undo_stack = self.tree_model.undo_stack
+        undo_stack.beginMacro(f"Удалить {name}")
+        self.id_tree.setUpdatesEnabled(False)
+        try:
+            # Deepest groups first, so the children of nested selected groups end up in the parent of the outer one
+            for node in sorted((node for node in nodes if node.parent is not root and node.children),
+                               key=lambda node: len(list(node.ancestors())), reverse=True):
+                self.tree_model.move_nodes(list(node.children), node.parent)
+            self.tree_model.remove_nodes(nodes)
+        finally:
+            self.id_tree.setUpdatesEnabled(True)
+            undo_stack.endMacro()
+
+    def group_selected(self):
+        # Moves the selected nodes into a new group in place of the first of them
+        nodes = self.tree_model.outermost(self.selected_nodes())
+        if not nodes:
+            return
+        group_name, ok = QInputDialog.getText(self, "Группировать", f"Имя новой группы для выбранных элементов ({len(nodes)}):")
+        if not ok or group_name.strip() == "":
+            return
+        group = TreeNode(self.tree_store.new_id(), group_name.strip())
+        undo_stack = self.tree_model.undo_stack
+        undo_stack.beginMacro(f"Группировать в {group.text}")
+        self.id_tree.setUpdatesEnabled(False)
+        try:
+            self.tree_model.add_nodes(nodes[0].parent, nodes[0].row(), [group])
+            self.tree_model.move_nodes(nodes, group)
+        finally:
+            self.id_tree.setUpdatesEnabled(True)
+            undo_stack.endMacro()
+        self.show_node(group)
+
+    def id_tree_context_menu(self, position):
+        selected = bool(self.id_tree.selectionModel().selectedRows())
+        menu = QMenu(self)
+        group_action = menu.addAction("Группировать в новую группу...")
+        group_action.setEnabled(selected)
+        delete_action = menu.addAction("Удалить выбранные...")
+        delete_action.setEnabled(selected)
+        menu.addSeparator()
+        menu.addAction(self.undo_action)
+        menu.addAction(self.redo_action)
+        action = menu.exec(self.id_tree.viewport().mapToGlobal(position))
+        if action == group_action:
+            self.group_selected()
+        elif action == delete_action:
+            self.delete_group()
 
     def find_item(self, name, parent=None):
-        if parent is None:
-            parent = self.main_group
-        for child in range(parent.childCount()):
-            child_item = parent.child(child)
-            if child_item.text(0) == name:
-                return child_item
-            child_item = self.find_item(name, child_item)
-            if child_item:
-                return child_item
+        # First node with the name, a descendant of parent if given
+        for node in self.tree_items.get(name, []):
+            if parent is None or parent in node.ancestors():
+                return node
         return None
-    
-    def item_value_update(self):
-        iterator = QTreeWidgetItemIterator(self.id_tree)
-        while iterator.value():
-            item = iterator.value()
-            self.id_tree.setCurrentItem(item)
-            iterator += 1
 
-        self.id_tree.clearSelection()
+    def index_tree_node(self, node):
+        if node.text not in self.tree_items:
+            self.tree_items[node.text] = [node]
+            self.queue_search_entries((node.text,))
+        else:
+            self.tree_items[node.text].append(node)
+
+    def unindex_tree_node(self, node, text=None):
+        text = node.text if text is None else text
+        nodes = self.tree_items.get(text)
+        if nodes is not None and node in nodes:
+            nodes.remove(node)
+            if not nodes:
+                del self.tree_items[text]
+                self.queue_search_entries((text,))
+
+    def tree_nodes_added(self, nodes):
+        for node in nodes:
+            self.index_tree_node(node)
+        texts = {node.text for node in nodes}
+        self.update_tree_columns(texts)
+        # Parents of the nodes may have stopped being leaves
+        self.update_reconciliation(texts | {node.parent.text for node in nodes})
+
+    def tree_nodes_removed(self, nodes):
+        for node in nodes:
+            self.unindex_tree_node(node)
+        if self.tree_hidden:
+            self.tree_hidden.difference_update(nodes)
+        self.update_reconciliation({node.text for node in nodes})
+
+    def tree_node_renamed(self, node, old_text):
+        self.unindex_tree_node(node, old_text)
+        self.index_tree_node(node)
+        self.update_tree_columns([node.text])
+        self.update_reconciliation([old_text, node.text])
+
+    def tree_rows_inserted(self, parent_index, first, last):
+        # Rows fetched or added while the search filter is active are filtered too.
+        # New rows are shown by the view, whatever tree_hidden knew of their nodes before.
+        parent = self.tree_model.node(parent_index)
+        if self.tree_hidden:
+            self.tree_hidden.difference_update(parent.children[first:last + 1])
+        if self.tree_filter is None:
+            return
+        matches, visible = self.tree_filter
+        shown = any(node.text in matches for node in [parent, *parent.ancestors()] if node.parent is not None)
+        for row in range(first, last + 1):
+            child = parent.children[row]
+            if not shown and child.text not in matches and child not in visible:
+                self.id_tree.setRowHidden(row, parent_index, True)
+                if self.tree_hidden is not None:
+                    self.tree_hidden.add(child)
+
+    def tree_layout_changed(self):
+        # Rows put back by PeerTreeModel.change_children are shown by the view, so the
+        # hidden rows are checked one by one on the next filter
+        self.tree_hidden = None
+        if self.tree_filter is not None:
+            self.filter_tree_rows()
+
+    def rebuild_tree_index(self):
+        # Texts of the previous tree are indexed again, as peers or not at all
+        self.queue_search_entries(self.tree_items)
+        self.tree_items = {}
+        self.tree_filter = None
+        self.tree_hidden = set()
+        for node in self.tree_model.root.walk():
+            if node.parent is not None:
+                self.index_tree_node(node)
+        # On startup left to start_deferred, it is not needed for the first paint
+        if self.painted:
+            self.reconcile()
+
+    def is_leaf_id(self, text):
+        return is_peer_id(text) and any(not node.children for node in self.tree_items.get(text, ()))
 
+    def peers_complete(self):
+        # Orphans are only known once every source has been read
+        return bool(self.folder_stats) and not self.scanners and not self.failed_folders
+
+    def reconcile(self):
+        # Both sets at once from the ID set and the leaf IDs of the tree
+        leaf_ids = {text for text in self.tree_items if self.is_leaf_id(text)}
+        self.orphan_ids.clear()
+        if self.peers_complete():
+            self.orphan_ids.update(leaf_ids.difference(self.known_ids))
+        self.unplaced_ids.clear()
+        self.unplaced_ids.update(self.known_ids - self.tree_items.keys())
+        self.reconciliation_changed()
+
+    def update_reconciliation(self, keys):
+        # Same as reconcile for the keys of changed files and nodes only
+        complete = self.peers_complete()
+        changed = []
+        for key in keys:
+            orphan = complete and key not in self.known_ids and self.is_leaf_id(key)
+            unplaced = key in self.known_ids and key not in self.tree_items
+            if orphan != (key in self.orphan_ids) or unplaced != (key in self.unplaced_ids):
+                (self.orphan_ids.add if orphan else self.orphan_ids.discard)(key)
+                (self.unplaced_ids.add if unplaced else self.unplaced_ids.discard)(key)
+                changed.append(key)
+        if changed:
+            self.reconciliation_changed(changed)
+
+    def reconciliation_changed(self, keys=None):
+        # Repaints the highlighting of the keys, of everything if keys is None
+        self.reconcile_button.setText(f"Сверка: {len(self.orphan_ids)} / {len(self.unplaced_ids)}")
+        if not self.reconcile_checkbox.isChecked():
+            return
+        if keys is None:
+            self.tree_model.columns_changed(first_column=0)
+        else:
+            self.tree_model.columns_changed([node for key in keys for node in self.tree_items.get(key, ())], first_column=0)
+        self.ids_model.rows_changed()
+
+    def reconcile_checkbox_toggled(self, checked):
+        self.tree_model.orphans = self.orphan_ids if checked else set()
+        self.ids_model.unplaced = self.unplaced_ids if checked else set()
+        self.tree_model.columns_changed(first_column=0)
+        self.ids_model.rows_changed()
+
+    def show_reconcile_menu(self):
+        menu = QMenu(self)
+        file_action = menu.addAction(f"Добавить в группу ID не в структуре ({len(self.unplaced_ids)})...")
+        file_action.setEnabled(bool(self.unplaced_ids))
+        prune_action = menu.addAction(f"Удалить из структуры ID без файла ({len(self.orphan_ids)})...")
+        prune_action.setEnabled(bool(self.orphan_ids))
+        next_action = menu.addAction("Показать следующий ID без файла")
+        next_action.setEnabled(bool(self.orphan_ids))
+        if not self.peers_complete():
+            menu.addSeparator()
+            menu.addAction("ID без файла будут найдены после чтения всех папок").setEnabled(False)
+        action = menu.exec(self.reconcile_button.mapToGlobal(self.reconcile_button.rect().bottomLeft()))
+        if action == file_action:
+            self.file_unplaced()
+        elif action == prune_action:
+            self.prune_orphans()
+        elif action == next_action:
+            self.show_next_orphan()
+
+    def orphan_nodes(self):
+        return [node for node in self.tree_model.root.walk() if node.text in self.orphan_ids and not node.children]
+
+    def file_unplaced(self):
+        # Unplaced IDs go to the end of a group in the order of ids_list,
+        # a name that is not a group yet creates a top level group
+        groups = {}
+        stack = [(child, child.text) for child in reversed(self.tree_model.root.children)]
+        while stack:
+            node, path = stack.pop()
+            if not is_peer_id(node.text):
+                groups.setdefault(path, node)
+                stack.extend((child, f"{path} / {child.text}") for child in reversed(node.children))
+        peer_ids = [peer_id for peer_id in self.ids_model.ids if peer_id in self.unplaced_ids]
+        path, ok = QInputDialog.getItem(self, "Добавить в группу", f"Группа для {len(peer_ids)} ID:", list(groups), 0, True)
+        if not ok or path.strip() == "":
+            return
+        group = groups.get(path)
+        self.tree_model.undo_stack.beginMacro(f"Добавить в группу {path}")
+        if group is None:
+            group = TreeNode(self.tree_store.new_id(), path.strip())
+            self.tree_model.add_nodes(self.tree_model.root, -1, [group])
+        with instrumentation.timer("file_unplaced"):
+            self.tree_model.add_nodes(group, -1, [TreeNode(self.tree_store.new_id(), peer_id) for peer_id in peer_ids])
+        self.tree_model.undo_stack.endMacro()
+        self.show_node(group)
+
+    def prune_orphans(self):
+        nodes = self.orphan_nodes()
+        confirm = QMessageBox.question(self, "Удалить ID без файла", f"Удалить из структуры {len(nodes)} ID, для которых нет файла *.toml?", QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if confirm == QMessageBox.StandardButton.Yes:
+            with instrumentation.timer("prune_orphans"):
+                self.tree_model.remove_nodes(nodes)
+
+    def show_next_orphan(self):
+        # Repeated calls cycle through the orphans in tree order
+        nodes = self.orphan_nodes()
+        if not nodes:
+            return
+        current_node = self.current_node()
+        position = nodes.index(current_node) + 1 if current_node in nodes else 0
+        self.show_node(nodes[position % len(nodes)])
+
+    def show_node(self, node):
+        # Fetches and expands the branches leading to the node, then selects it
+        for ancestor in reversed(list(node.ancestors())):
+            self.id_tree.expand(self.tree_model.index_of(ancestor))
+        index = self.tree_model.index_of(node)
+        self.id_tree.setCurrentIndex(index)
+        self.id_tree.scrollTo(index)
+
+    def reveal_in_tree(self, peer_id):
+        # Repeated calls cycle through all nodes of the ID
+        nodes = self.tree_items.get(peer_id)
+        if not nodes:
+            QMessageBox.information(self, "Информация", f"ID {peer_id} нет в структуре.")
+            return
+        current_node = self.current_node()
+        position = nodes.index(current_node) + 1 if current_node in nodes else 0
+        self.show_node(nodes[position % len(nodes)])
+
+    def ids_list_context_menu(self, position):
+        index = self.ids_list.indexAt(position)
+        if not index.isValid():
+            return
+        peer_id = self.ids_model.rows[index.row()]
+        menu = QMenu(self)
+        reveal_action = menu.addAction("Показать в структуре")
+        reveal_action.setEnabled(peer_id in self.tree_items)
+        if menu.exec(self.ids_list.mapToGlobal(position)) == reveal_action:
+            self.reveal_in_tree(peer_id)
+
+    def item_value_update(self):
+        started = time.perf_counter()
+        count = self.update_tree_columns()
+        elapsed = (time.perf_counter() - started) * 1000
+        instrumentation.record("item_value_update", elapsed)
+        self.update_button.setToolTip("Обновить название, пользователь, компьютер, система\n"
+                                      f"Последнее обновление: {count} ID за {elapsed:.0f} мс")
+        self.update_ids_tooltip()
         return True
-#########For QTreeWidget End###############
+
+    def update_tree_columns(self, peer_ids=None):
+        # Read details of tree nodes in one pass without touching the selection,
+        # only of peer_ids if given. Returns the number of IDs updated.
+        all_rows = peer_ids is None
+        if all_rows:
+            peer_ids = self.tree_items.keys()
+        peer_ids = [peer_id for peer_id in peer_ids if peer_id in self.known_ids and peer_id in self.tree_items]
+        if not peer_ids:
+            return 0
+        self.peer_index.get_many([self.peer_path(peer_id) for peer_id in peer_ids])
+        if all_rows:
+            self.tree_model.columns_changed()
+        else:
+            self.tree_model.columns_changed([node for peer_id in peer_ids for node in self.tree_items[peer_id]])
+        return len(peer_ids)
+
+    def cached_details(self, peer_id):
+        if peer_id not in self.known_ids:
+            return None
+        return self.peer_index.cached(self.peer_path(peer_id))
+#########For QTreeView End###############
 
     def rustdesk_run_button_clicked(self):
-        try:
-            # Run rustdesk
-            command = f'{os.path.normpath(self.rustdesk_path)}'
-            subprocess.Popen(command, shell=True)
-        except FileNotFoundError:
+        if self.rustdesk_path == "":
             QMessageBox.information(self, "Информация", "Путь к Rustdesk.exe не задан.")
+            return
+        # Run rustdesk
+        self.launcher.run(os.path.normpath(self.rustdesk_path))
+        self.update_sessions()
     
     def load_config(self):
         try:
@@ -317,33 +1572,62 @@ class RustDeskManager(QWidget):
                         self.rustdesk_path = config["paths"]["rustdesk_path"]
                         if self.rustdesk_path != "":
                             self.rustdesk_input.setText(os.path.normpath(self.rustdesk_path))
+                    self.extra_folder_paths = list(config["paths"].get("extra_folder_paths", []))
+                    self.extra_folders_list.addItems([os.path.normpath(folder) for folder in self.extra_folder_paths])
+                if "Options" in config:
+                    self.watch_checkbox.setChecked(config["Options"].get("watch_work_folder", False))
+                    self.max_sessions_input.setValue(config["Options"].get("max_sessions", DEFAULT_MAX_SESSIONS))
+                    self.instrumentation_checkbox.setChecked(config["Options"].get("instrumentation", False))
+                    self.fast_start_checkbox.setChecked(config["Options"].get("fast_start", True))
                 if "width" in config["WindowSize"] and "height" in config["WindowSize"]:
                     self.resize(config["WindowSize"]["width"], config["WindowSize"]["height"])
-                self.load_ids()
+                if not self.fast_start_checkbox.isChecked():
+                    self.load_ids()
+                elif not self.restore_peers():
+                    # Nothing to restore, the folders are scanned after the first paint
+                    self.deferred_load = True
             
         except FileNotFoundError:
             QMessageBox.information(self, "Первый запуск", "При начале работы с программой укажите, пожалуйста, пути Rustdesk в настройках!")
             pass
 
+        self.tree_store.open()
+        if self.fast_start_checkbox.isChecked():
+            with instrumentation.timer("tree_store_load_top"):
+                root = self.tree_store.load_top()
+            if root.children:
+                self.tree_model.set_root(root)
+                self.id_tree.setEnabled(False)
+                return
+        self.load_tree()
+
+    def load_tree(self):
+        with instrumentation.timer("tree_store_load"):
+            root = self.tree_store.load()
+        if not root.children and os.path.exists("config.dat"):
+            # Structure of previous versions, migrated until config.db has one
+            self.migrate_config_dat()
+        else:
+            self.tree_model.set_root(root)
+        self.tree_loaded = True
+        self.id_tree.setEnabled(True)
+
+    def migrate_config_dat(self):
+        # One-time migration of the pickled structure. config.db is replaced by a complete
+        # database only, a config.dat that can not be read is left for the next start.
         try:
             with open("config.dat", "rb") as f:
                 config = pickle.load(f)
-                if "TreeStructure" in config:
-                    self.load_tree_structure(config["TreeStructure"])
-        except FileNotFoundError:
-            pass
+            self.load_tree_structure(config.get("TreeStructure", []))
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError, TypeError) as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось перенести структуру из config.dat:\n{e}\nФайл оставлен без изменений.")
+            return
+        self.tree_store.replace(self.tree_model.root)
+        os.replace("config.dat", "config.dat.bak")
 
     def load_tree_structure(self, structure):
-        def create_item(item, parent=None):
-            item_widget = QTreeWidgetItem([item["text"]])
-            if parent is None:
-                parent = self.id_tree.addTopLevelItem(item_widget)
-            else:
-                parent.addChild(item_widget)
-            for child in item.get("children", []):
-                create_item(child, item_widget)
-        for item in structure:
-            create_item(item)
+        with instrumentation.timer("load_tree_structure"):
+            self.tree_model.set_root(build_tree(structure, self.tree_store.new_id))
 
     def browse_work_folder(self):
         current_path = self.work_folder_input.text()
@@ -354,6 +1638,23 @@ class RustDeskManager(QWidget):
             self.save_config()
             self.load_ids()
 
+    def add_extra_folder(self):
+        folder_path = QFileDialog.getExistingDirectory(self, "Выберите дополнительную папку с toml конфигурационными файлами.")
+        if folder_path and folder_path != self.work_folder_path and folder_path not in self.extra_folder_paths:
+            self.extra_folder_paths.append(folder_path)
+            self.extra_folders_list.addItem(os.path.normpath(folder_path))
+            self.save_config()
+            self.load_ids()
+
+    def remove_extra_folder(self):
+        row = self.extra_folders_list.currentRow()
+        if row < 0:
+            return
+        del self.extra_folder_paths[row]
+        self.extra_folders_list.takeItem(row)
+        self.save_config()
+        self.load_ids()
+
     def browse_rustdesk(self):
         current_path = self.rustdesk_input.text()
         rustdesk_path = QFileDialog.getOpenFileName(self,"Выберите rustdesk.exe",current_path,"Файлы rustdesk (rustdesk*.exe)")[0]
@@ -362,97 +1663,495 @@ class RustDeskManager(QWidget):
             self.rustdesk_input.setText(os.path.normpath(rustdesk_path))
             self.save_config()
 
+    def peer_folders(self):
+        # Peer sources in order of precedence on equal mtime, the work folder first
+        return list(dict.fromkeys(folder for folder in [self.work_folder_path] + self.extra_folder_paths if folder != ""))
+
     def load_ids(self):
-        self.ids = []
-        for filename in os.listdir(self.work_folder_path):
-            if filename.endswith(".toml"):
-                self.ids.append(os.path.splitext(filename)[0])
-        self.ids_list.clear()
-        self.ids_list.addItems(self.ids)
-        self.ids_list.setCurrentRow(0)
-        self.ids_label.setToolTip(f"Всего {len(self.ids_list)} файлов")
+        # Times the start of the scans only, they run on threads: the time until all
+        # folders are listed is recorded as load_ids_scan by scanner_finished
+        with instrumentation.timer("load_ids"):
+            self.start_scan()
+
+    def start_scan(self):
+        # Every peer source is streamed into ids_list by its own PeersScanner, so a slow
+        # network folder does not hold back the local ones. Running scans are cancelled.
+        for scanner in self.scanners.values():
+            scanner.cancel()
+        self.scanners = {}
+        self.peer_sources = {}
+        self.known_ids = self.peer_sources.keys()
+        self.search_index = SearchIndex()
+        self.search_pending = set()
+        self.queue_search_entries(self.tree_items)
+        self.ids_model.clear()
+        self.folder_stats = {}
+        self.failed_folders = set()
+        self.update_folder_watcher()
+        folders = self.peer_folders()
+        self.reconcile()
+        if not folders:
+            return
+        self.ids_label.setToolTip("Загрузка списка файлов...")
+        self.scan_started = time.perf_counter()
+        for folder in folders:
+            self.folder_stats[folder] = {}
+            scanner = self.new_scanner(folder)
+            scanner.chunk_found.connect(self.scanner_chunk_found)
+            scanner.scan_finished.connect(self.scanner_finished)
+            scanner.scan_failed.connect(self.scanner_failed)
+            self.scanners[folder] = scanner
+            scanner.start()
+
+    def new_scanner(self, folder):
+        scanner = PeersScanner(folder, self)
+        self.live_scanners.add(scanner)
+        scanner.finished.connect(lambda: self.live_scanners.discard(scanner))
+        return scanner
+
+    def scanner_chunk_found(self, stats):
+        scanner = self.sender()
+        if self.scanners.get(scanner.folder) is not scanner:
+            return
+        self.peer_index.validate(scanner.folder, stats)
+        self.folder_stats[scanner.folder].update(stats)
+        first_chunk = not self.ids_model.rows
+        self.update_peer_sources([sys.intern(os.path.splitext(filename)[0]) for filename in stats])
+        if first_chunk and self.ids_model.rows:
+            self.ids_list.setCurrentIndex(self.ids_model.index(0))
+        self.ids_label.setToolTip(f"Загрузка списка файлов... найдено {len(self.ids_model.ids)}")
+
+    def scanner_finished(self, stats):
+        scanner = self.sender()
+        if self.scanners.get(scanner.folder) is not scanner:
+            return
+        del self.scanners[scanner.folder]
+        self.peer_index.prune(scanner.folder, stats)
+        self.folder_stats[scanner.folder] = stats
+        instrumentation.count("peer_files_found", len(stats))
+        if not self.scanners:
+            instrumentation.record("load_ids_scan", (time.perf_counter() - self.scan_started) * 1000)
+            self.reconcile()
+        self.update_ids_tooltip()
+        self.item_value_update()
+        if self.search_input.text().strip():
+            self.apply_search_filter()
+
+    def scanner_failed(self, error):
+        scanner = self.sender()
+        if self.scanners.get(scanner.folder) is not scanner:
+            return
+        del self.scanners[scanner.folder]
+        self.failed_folders.add(scanner.folder)
+        self.update_ids_tooltip()
+        QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать папку {scanner.folder}:\n{error}")
+
+    def update_peer_sources(self, peer_ids):
+        # Resolves the source of peer_ids again after folder_stats changed and updates ids_list.
+        # Returns the IDs added, removed and moved to another source.
+        sources = peer_sources(self.peer_folders(), self.folder_stats, peer_ids)
+        added = []
+        removed = set()
+        moved = []
+        for peer_id in dict.fromkeys(peer_ids):
+            source = sources.get(peer_id)
+            previous = self.peer_sources.get(peer_id)
+            if source == previous:
+                continue
+            if source is None:
+                del self.peer_sources[peer_id]
+                removed.add(peer_id)
+            else:
+                self.peer_sources[peer_id] = source
+                (added if previous is None else moved).append(peer_id)
+        if removed:
+            self.ids_model.remove_ids(removed)
+        self.ids_model.append_ids(added)
+        if moved:
+            self.ids_model.rows_changed()
+        self.queue_search_entries(added + list(removed) + moved)
+        self.update_reconciliation(added + list(removed))
+        return added, removed, moved
+
+    def peer_source(self, peer_id):
+        # Number and folder of the source of a peer ID, shown by ids_list with several sources only
+        folders = self.peer_folders()
+        folder = self.peer_sources.get(peer_id)
+        if len(folders) < 2 or folder not in folders:
+            return None
+        return str(folders.index(folder) + 1), folder
+
+    def watch_checkbox_toggled(self, checked):
+        self.update_folder_watcher()
+        if checked and self.folder_stats:
+            # Catch up with changes made while the folders were not watched
+            self.watch_pending.update(self.folder_stats)
+            self.rescan_work_folder()
+
+    def update_folder_watcher(self):
+        if self.folder_watcher.directories():
+            self.folder_watcher.removePaths(self.folder_watcher.directories())
+        folders = self.peer_folders()
+        if self.watch_checkbox.isChecked() and folders:
+            self.folder_watcher.addPaths(folders)
+            self.watch_poll_timer.start()
+        else:
+            self.watch_poll_timer.stop()
+
+    def work_folder_changed(self, path):
+        # RustDesk may rewrite many files at once, so events are debounced
+        self.watch_pending.add(path)
+        now = time.monotonic()
+        if not self.watch_timer.isActive():
+            self.watch_first_event = now
+            self.watch_timer.start()
+        elif (now - self.watch_first_event) * 1000 < WATCH_MAX_DELAY_MS:
+            self.watch_timer.start()
+
+    def poll_work_folders(self):
+        # In-place rewrites of peer files are only seen by a new listing, its size and
+        # mtime are compared by apply_folder_stats like after a folder event
+        self.watch_pending.update(self.folder_stats)
+        self.rescan_work_folder()
+
+    def rescan_work_folder(self):
+        # Changed folders are scanned again unless a scan of them is running,
+        # those are retried when it is done
+        for folder in list(self.watch_pending):
+            if folder in self.scanners or folder in self.watch_scanners:
+                continue
+            self.watch_pending.discard(folder)
+            if folder not in self.folder_stats:
+                continue
+            scanner = self.new_scanner(folder)
+            scanner.scan_finished.connect(self.watch_scan_finished)
+            scanner.scan_failed.connect(self.watch_scan_failed)
+            self.watch_scanners[folder] = scanner
+            scanner.start()
+        if self.watch_pending:
+            self.watch_timer.start()
+
+    def watch_scan_failed(self, error):
+        scanner = self.sender()
+        folder = scanner.folder
+        if self.watch_scanners.get(folder) is not scanner:
+            return
+        del self.watch_scanners[folder]
+        if folder in self.startup_rescans:
+            # Restored peers of a folder that can not be read are dropped, as without fast start
+            self.failed_folders.add(folder)
+            previous_stats = self.folder_stats[folder]
+            self.folder_stats[folder] = {}
+            self.update_peer_sources([sys.intern(os.path.splitext(filename)[0]) for filename in previous_stats])
+            self.startup_rescan_done(folder)
+            self.update_ids_tooltip()
+            QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать папку {folder}:\n{error}")
+
+    def watch_scan_finished(self, stats):
+        scanner = self.sender()
+        folder = scanner.folder
+        if self.watch_scanners.get(folder) is not scanner:
+            return
+        del self.watch_scanners[folder]
+        if folder in self.folder_stats and folder not in self.scanners:
+            self.apply_folder_stats(folder, stats)
+        self.startup_rescan_done(folder)
+
+    def apply_folder_stats(self, folder, stats):
+        # Applies the difference of a new listing of the folder to the list and the tree
+        previous_stats = self.folder_stats[folder]
+        added = [filename for filename in stats if filename not in previous_stats]
+        removed = [filename for filename in previous_stats if filename not in stats]
+        modified = {filename: key for filename, key in stats.items()
+                    if filename in previous_stats and previous_stats[filename] != key}
+        self.folder_stats[folder] = stats
+        if not added and not removed and not modified:
+            return
+
+        self.peer_index.validate(folder, modified)
+        if removed:
+            self.peer_index.prune(folder, stats)
+        touched_ids = [sys.intern(os.path.splitext(filename)[0]) for filename in removed + added + list(modified)]
+        added_ids, removed_ids, moved_ids = self.update_peer_sources(touched_ids)
+        # IDs shown from another file now, or from a modified file of their source
+        changed_ids = added_ids + moved_ids + [peer_id for peer_id in (os.path.splitext(filename)[0] for filename in modified)
+                                              if self.peer_sources.get(peer_id) == folder and peer_id not in moved_ids]
+        if changed_ids:
+            self.update_tree_columns(changed_ids)
+            current_index = self.ids_list.currentIndex()
+            if current_index.isValid() and self.ids_model.rows[current_index.row()] in changed_ids:
+                self.set_details_text(self.ids_model.rows[current_index.row()])
+        # Details of modified files, added and moved IDs were queued by update_peer_sources
+        self.queue_search_entries(changed_ids)
+        if self.search_input.text().strip():
+            self.apply_search_filter()
+        self.update_ids_tooltip()
+
+    def queue_search_entries(self, keys):
+        self.search_pending.update(keys)
+        if self.search_pending and not self.search_index_timer.isActive():
+            self.search_index_timer.start()
+
+    def index_search_step(self):
+        started = time.perf_counter()
+        pending = self.search_pending
+        while pending and (time.perf_counter() - started) * 1000 < SEARCH_INDEX_STEP_MS:
+            self.update_search_entries([pending.pop() for _ in range(min(SEARCH_INDEX_BATCH, len(pending)))])
+        if not pending:
+            self.search_index_timer.stop()
+
+    def flush_search_index(self):
+        # Searched before index_search_step was done
+        if self.search_pending:
+            with instrumentation.timer("flush_search_index"):
+                self.update_search_entries(list(self.search_pending))
+                self.search_pending.clear()
+                self.search_index_timer.stop()
+
+    def update_search_entries(self, keys):
+        # Peers are found by their details, other tree nodes by text only
+        peer_ids = [key for key in keys if key in self.known_ids]
+        details = self.peer_index.get_many([self.peer_path(peer_id) for peer_id in peer_ids])
+        for peer_id in peer_ids:
+            record = details.get(self.peer_path(peer_id)) or PeerRecord()
+            self.search_index.set(peer_id, [peer_id, record.alias, record.username, record.hostname, record.platform])
+        for key in keys:
+            if key in self.known_ids:
+                continue
+            if key in self.tree_items:
+                self.search_index.set(key, [key])
+            else:
+                self.search_index.remove(key)
+
+    def search_text_changed(self):
+        if self.search_timer.isActive():
+            self.search_changed = True
+        else:
+            self.apply_search_filter()
+            self.search_timer.start()
+
+    def search_timer_timeout(self):
+        if self.search_changed:
+            self.search_changed = False
+            self.apply_search_filter()
+            self.search_timer.start()
+
+    def apply_search_filter(self):
+        with instrumentation.timer("apply_search_filter"):
+            query = self.search_input.text().strip()
+            if query:
+                self.flush_search_index()
+                matches = self.search_index.search(query)
+            else:
+                matches = None
+            self.ids_model.set_filter(matches)
+            self.filter_tree(matches)
+
+    def filter_tree(self, matches):
+        # Matching nodes are shown with their ancestors and descendants
+        self.tree_filter = None
+        ancestors = set()
+        if matches is not None:
+            root = self.tree_model.root
+            for key in matches:
+                for node in self.tree_items.get(key, ()):
+                    parent = node.parent
+                    while parent is not root and parent not in ancestors:
+                        ancestors.add(parent)
+                        parent = parent.parent
+            self.tree_filter = (matches, ancestors)
+        self.id_tree.setUpdatesEnabled(False)
+        if 0 < len(ancestors) <= SEARCH_EXPAND_LIMIT:
+            collapsed = [node for node in ancestors if not self.id_tree.isExpanded(self.tree_model.index_of(node))]
+            if sum(len(node.children) for node in collapsed) <= SEARCH_EXPAND_ROWS:
+                # Parents go before their children, so every expanded branch is already fetched
+                for node in sorted(collapsed, key=lambda node: sum(1 for _ in node.ancestors())):
+                    self.id_tree.expand(self.tree_model.index_of(node))
+        self.filter_tree_rows()
+        self.id_tree.setUpdatesEnabled(True)
+
+    def filter_tree_rows(self):
+        # Hides and shows the fetched rows whose state differs from tree_hidden only. Rows
+        # below hidden ones keep their state until their parent is shown again.
+        matches, ancestors = self.tree_filter or (None, None)
+        hidden_nodes = self.tree_hidden
+        if hidden_nodes is None:
+            hidden_nodes = set()
+            for parent in self.tree_model.root.walk():
+                if parent.fetched and parent.children:
+                    parent_index = self.tree_model.index_of(parent)
+                    hidden_nodes.update(child for row, child in enumerate(parent.children) if self.id_tree.isRowHidden(row, parent_index))
+        changed = []
+        stack = [(self.tree_model.root, matches is None)]
+        while stack:
+            node, shown = stack.pop()
+            if not node.fetched:
+                continue
+            for child in node.children:
+                if not shown and child.text not in matches and child not in ancestors:
+                    if child not in hidden_nodes:
+                        changed.append((node, child, True))
+                    continue
+                if child in hidden_nodes:
+                    changed.append((node, child, False))
+                if child.children:
+                    stack.append((child, shown or child.text in matches))
+        rows = {}
+        for parent, child, hidden in changed:
+            if parent not in rows:
+                rows[parent] = ({child: row for row, child in enumerate(parent.children)}, self.tree_model.index_of(parent))
+            row_of, parent_index = rows[parent]
+            self.id_tree.setRowHidden(row_of[child], parent_index, hidden)
+            (hidden_nodes.add if hidden else hidden_nodes.discard)(child)
+        self.tree_hidden = hidden_nodes
+
+    def update_ids_tooltip(self):
+        tooltip = (f"Всего {len(self.ids_model.ids)} файлов\n"
+                   f"Описания: {self.peer_index.hits} из кэша, {self.peer_index.misses} прочитано из файлов")
+        if self.startup_rescans:
+            tooltip += "\nСписок прошлого запуска, идёт проверка папок..."
+        if self.time_to_interactive is not None:
+            tooltip += f"\nОкно отрисовано через {self.time_to_first_paint:.0f} мс после запуска"
+            if self.time_to_tree_loaded is not None:
+                tooltip += f", структура загружена через {self.time_to_tree_loaded:.0f} мс"
+            tooltip += f", готово к работе через {self.time_to_interactive:.0f} мс"
+        self.ids_label.setToolTip(tooltip)
+
+    def peer_path(self, peer_id):
+        return os.path.join(self.peer_sources.get(peer_id, self.work_folder_path), peer_id) + ".toml"
 
     def tree_selection_changed(self):
-        selected_id = self.id_tree.currentItem().text(0)
+        if self.current_node() is None:
+            return
+        selected_id = self.current_node().text
         
-        if self.ids_list.findItems(selected_id, Qt.MatchFlag.MatchFixedString):
+        if selected_id in self.known_ids:
             details = self.set_details_text(selected_id)
             if details is not None:
-                self.id_tree.currentItem().setText(1, details["alias"])
-                self.id_tree.currentItem().setText(2, details["username"])
-                self.id_tree.currentItem().setText(3, details["hostname"])
-                self.id_tree.currentItem().setText(4, details["platform"])
+                self.tree_model.columns_changed(self.tree_items.get(selected_id, []))
 
         else:
             pass
 
     def ids_list_selection_changed(self):
-        try:
-            selected_id = self.ids_list.currentItem().text()
-            self.set_details_text(selected_id)
-        except AttributeError:
-            pass
+        index = self.ids_list.currentIndex()
+        if index.isValid():
+            self.set_details_text(self.ids_model.rows[index.row()])
     def set_details_text(self,selected_id):
         try:
-            filename = os.path.join(self.work_folder_path, selected_id) + ".toml"
-            with open(filename, "r", encoding="utf-8") as f:
-                config = toml.load(f)
-                alias = config.get("options", {}).get("alias")
-                username = config.get("info", {}).get("username")
-                hostname = config.get("info", {}).get("hostname")
-                platform = config.get("info", {}).get("platform")
-                details = f"Alias: {alias}\nUsername: {username}\nHostname: {hostname}\nPlatform: {platform}\n"
-                self.details_text.setText(details)
-                # Внимание! Здесь details перезаписывается
-                details = {
-                    "alias": config.get("options", {}).get("alias"),
-                    "username": config.get("info", {}).get("username"),
-                    "hostname": config.get("info", {}).get("hostname"),
-                    "platform": config.get("info", {}).get("platform")
-                }
+            filename = self.peer_path(selected_id)
+            with instrumentation.timer("set_details_text"):
+                details = self.peer_index.get(filename)
+            source = f"Source: {os.path.normpath(os.path.dirname(filename))}\n" if len(self.peer_folders()) > 1 else ""
+            self.details_text.setText(f"Alias: {details.alias}\nUsername: {details.username}\n"
+                                      f"Hostname: {details.hostname}\nPlatform: {details.platform}\n" + source)
+            self.update_ids_tooltip()
             return details
         except FileNotFoundError:
             QMessageBox.warning(self, "Ошибка", f"Файл {filename} не найден.")
             return
+        except ValueError as e:
+            # toml.TomlDecodeError and UnicodeDecodeError of a damaged file
+            QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать файл {filename}:\n{e}")
+            return
 
     def save_tree_structure(self):
-        structure = []
-        def traverse(item):
-            children = []
-            for i in range(item.childCount()):
-                child = item.child(i)
-                children.append({
-                    "text": child.text(0),
-                    "children": traverse(child)
-                })
-            return children
-        for i in range(self.id_tree.topLevelItemCount()):
-            top_level_item = self.id_tree.topLevelItem(i)
-            structure.append({
-                "text": top_level_item.text(0),
-                "children": traverse(top_level_item)
-            })
-        return structure
+        return self.tree_model.root.to_structure()
+
+    def export_tree(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Экспорт структуры", "structure.json", "JSON (*.json);;CSV (*.csv)")
+        if not filename:
+            return
+        try:
+            with instrumentation.timer("export_tree"):
+                # utf-8-sig lets Excel open the CSV with Cyrillic group names
+                with open(filename, "w", encoding="utf-8-sig" if tree_format(filename) == "csv" else "utf-8", newline="") as f:
+                    write_tree(self.tree_model.root, f, tree_format(filename))
+        except OSError as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить {filename}:\n{e}")
+
+    def import_tree(self):
+        # The file is read and added in batches of IMPORT_BATCH_SIZE nodes without repainting the tree.
+        # Merging adds only the groups and IDs that are not in the structure yet.
+        import csv
+        filename, _ = QFileDialog.getOpenFileName(self, "Импорт структуры", "", "Структура (*.json *.csv);;JSON (*.json);;CSV (*.csv)")
+        if not filename:
+            return
+        answer = QMessageBox.question(self, "Импорт структуры", "Объединить с текущей структурой?\n"
+                                      "Да - добавить новые группы и ID, Нет - заменить структуру.",
+                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel)
+        if answer == QMessageBox.StandardButton.Cancel:
+            return
+        merge = answer == QMessageBox.StandardButton.Yes
+        importer = TreeImporter(self.tree_model.root if merge else TreeNode(None, ""), self.tree_store.new_id, merge)
+        error = None
+        # A merge is one undo step, replacing starts a new undo history
+        if merge:
+            self.tree_model.undo_stack.beginMacro(f"Импорт {os.path.basename(filename)}")
+        self.id_tree.setUpdatesEnabled(False)
+        try:
+            with instrumentation.timer("import_tree"), open(filename, "r", encoding="utf-8-sig", newline="") as f:
+                for path in read_tree(f, tree_format(filename)):
+                    importer.add(path)
+                    if merge and importer.pending_count >= IMPORT_BATCH_SIZE:
+                        self.add_imported_nodes(importer.flush())
+        except (OSError, ValueError, csv.Error) as e:
+            error = e
+        finally:
+            if merge:
+                self.add_imported_nodes(importer.flush())
+                self.tree_model.undo_stack.endMacro()
+            self.id_tree.setUpdatesEnabled(True)
+        if error is not None and not merge:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось загрузить {filename}:\n{error}\nСтруктура не изменена.")
+            return
+        if not merge:
+            attach_nodes(importer.flush())
+            self.tree_model.set_root(importer.root)
+        self.save_config()
+        message = f"Добавлено: {importer.added}, уже было в структуре: {importer.skipped}"
+        if error is not None:
+            QMessageBox.warning(self, "Ошибка", f"Импорт {filename} прерван:\n{error}\n{message}")
+        else:
+            QMessageBox.information(self, "Импорт структуры", message)
+
+    def add_imported_nodes(self, batch):
+        for parent, nodes in batch:
+            self.tree_model.add_nodes(parent, -1, nodes)
     
     def save_config(self):
+        with instrumentation.timer("save_config"):
+            self.write_config()
+
+    def write_config(self):
         config = {
             "paths": {
                 "work_folder_path": self.work_folder_path,
-                "rustdesk_path": self.rustdesk_path
+                "rustdesk_path": self.rustdesk_path,
+                "extra_folder_paths": self.extra_folder_paths
             },
             "WindowSize": {
                 "width": self.width(),
                 "height": self.height()
+            },
+            "Options": {
+                "watch_work_folder": self.watch_checkbox.isChecked(),
+                "max_sessions": self.max_sessions_input.value(),
+                "instrumentation": self.instrumentation_checkbox.isChecked(),
+                "fast_start": self.fast_start_checkbox.isChecked()
             }
         }
-        with open("config.toml", "w", encoding="utf-8") as f:
+        with open("config.toml.tmp", "w", encoding="utf-8") as f:
             toml.dump(config, f)
-        
-        config = {
-            "TreeStructure": self.save_tree_structure()
-        }
-        with open("config.dat", "wb") as f:
-            pickle.dump(config, f)
+        os.replace("config.toml.tmp", "config.toml")
+
+        if self.tree_loaded:
+            self.tree_store.save(self.tree_model.root)
+
+        # Listings of the folders read completely, restored on the next fast start
+        self.peer_index.set_folders({folder: stats for folder, stats in self.folder_stats.items()
+                                     if folder not in self.scanners and folder not in self.failed_folders})
+        self.peer_index.save()
 
     def run_rustdesk(self):
         #if self.ids == []:
@@ -461,37 +2160,88 @@ class RustDeskManager(QWidget):
             # Get sender. It can be ids_list or id_tree
             sender = self.sender()
             if sender == self.ids_list or sender == self.run_button:
-                if self.ids != []:
-                    selected_id = self.ids_list.currentItem().text()
-                else:
+                selected_ids = [self.ids_model.rows[index.row()] for index in self.ids_list.selectionModel().selectedRows()]
+                if selected_ids == []:
                     #QMessageBox.warning(self, "Внимание!", "Список ID пуст.")
                     return
             elif sender == self.id_tree:
-                if self.id_tree.currentItem().childCount() == 0:
-                    selected_id = self.id_tree.currentItem().text(0)
-                    if not selected_id.isdigit() or len(selected_id) < 7:
-                        QMessageBox.warning(self, "Ошибка", "Некорректный ID")
-                        return
-                else:
+                nodes = [self.tree_model.node(index) for index in self.id_tree.selectionModel().selectedRows()]
+                selected_ids = [node.text for node in nodes if not node.children]
+                if selected_ids == []:
+                    return
+                if not all(is_peer_id(selected_id) for selected_id in selected_ids):
+                    QMessageBox.warning(self, "Ошибка", "Некорректный ID")
                     return
             else:
                 return
             
-            # Run rustdesk with selected id
-            command = f'"{os.path.normpath(self.rustdesk_path)}" --connect {selected_id}'
-            subprocess.Popen(command, shell=True)
-
+            # Run rustdesk with selected ids
+            with instrumentation.timer("run_rustdesk"):
+                self.launcher.connect(os.path.normpath(self.rustdesk_path), selected_ids)
+            self.update_sessions()
 
         elif self.rustdesk_path == "":
             QMessageBox.information(self, "Информация", "Путь к Rustdesk.exe не задан.")
 
+    def instrumentation_checkbox_toggled(self, checked):
+        instrumentation.enabled = checked or instrumentation.forced
+        self.stats_button.setEnabled(instrumentation.enabled)
+
+    def show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self)
+        self.stats_dialog.refresh()
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
+
+    def max_sessions_changed(self, value):
+        self.launcher.max_sessions = value
+        self.poll_sessions()
+
+    def poll_sessions(self):
+        if self.launcher.poll():
+            finished = [f"{session.peer_id or 'Rustdesk'}: код {session.returncode}" for session in self.launcher.finished]
+            self.sessions_label.setToolTip("Последние завершённые:\n" + "\n".join(finished))
+        self.update_sessions()
+
+    def update_sessions(self):
+        self.sessions_list.clear()
+        for session in self.launcher.sessions.values():
+            started = time.strftime("%H:%M:%S", time.localtime(session.started))
+            self.sessions_list.addItem(f"{session.peer_id or 'Rustdesk'} (PID {session.process.pid}, {started})")
+        for program, peer_id in self.launcher.queue:
+            self.sessions_list.addItem(f"{peer_id} (в очереди)")
+        self.sessions_label.setText(f"Сеансы: {len(self.launcher.sessions)}")
+        if self.launcher.sessions or self.launcher.queue:
+            self.sessions_timer.start()
+        else:
+            self.sessions_timer.stop()
+        if self.launcher.errors:
+            program, error = self.launcher.errors[-1]
+            self.launcher.errors = []
+            QMessageBox.warning(self, "Ошибка", f"Не удалось запустить {program}:\n{error}")
+
     def closeEvent(self, event):
         self.save_config()
+        self.tree_store.close()
+        scanners = list(self.live_scanners)
+        for scanner in scanners:
+            scanner.cancel()
+        deadline = QDeadlineTimer(SCANNER_CLOSE_WAIT_MS)
+        for scanner in scanners:
+            if not scanner.wait(deadline):
+                scanner.detach()
         event.accept()
 
 if __name__ == "__main__":
+    profile_path = os.environ.get(PROFILE_ENV)
+    if profile_path:
+        instrumentation.start_profile()
     app = QApplication(sys.argv)
     window = RustDeskManager()
     window.setWindowIcon(QIcon("rustdeskmanager.ico"))
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    exit_code = app.exec()
+    if profile_path:
+        instrumentation.stop_profile(profile_path)
+    sys.exit(exit_code)
\ No newline at end of file
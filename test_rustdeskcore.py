@@ -0,0 +1,296 @@
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import rustdeskcore
+from rustdeskcore import PeerIndex, PeerRecord, SessionLauncher, build_tree, extract_peer_details, parse_peer_details, read_tree, write_tree
+
+PEER_TEMPLATE = """password = [1, 2, 3]
+size = [0, 0, 1920, 1080]
+view_style = 'adaptive'
+
+[options]
+alias = 'Office 12'
+codec-preference = 'auto'
+
+[info]
+username = 'user'
+hostname = 'desktop-12'
+platform = 'Windows'
+
+[ui_flutter]
+wm_RemoteDesktop = '{"width":1280.0,"height":720.0}'
+"""
+
+class ExtractPeerDetailsTest(unittest.TestCase):
+    def assert_same_as_parse(self, text):
+        details = extract_peer_details(text)
+        self.assertIsNotNone(details)
+        self.assertEqual(details, parse_peer_details(text))
+        return details
+
+    def test_template(self):
+        details = self.assert_same_as_parse(PEER_TEMPLATE)
+        self.assertEqual(details, PeerRecord("Office 12", "user", "desktop-12", "Windows"))
+
+    def test_double_quotes_and_comments(self):
+        text = ('[options] # peer options\n'
+                '# alias = "commented"\n'
+                'alias = "Бухгалтерия" # comment\n'
+                '[info]\n'
+                'hostname=\'pc\'\n')
+        details = self.assert_same_as_parse(text)
+        self.assertEqual(details, PeerRecord("Бухгалтерия", None, "pc", None))
+
+    def test_missing_tables(self):
+        details = self.assert_same_as_parse("password = []\n")
+        self.assertEqual(details, PeerRecord(None, None, None, None))
+
+    def test_crlf(self):
+        self.assert_same_as_parse(PEER_TEMPLATE.replace("\n", "\r\n"))
+
+    def test_other_tables_ignored(self):
+        text = PEER_TEMPLATE + "[transfer]\nalias = 'not this one'\n"
+        self.assertEqual(self.assert_same_as_parse(text).alias, "Office 12")
+
+    def test_fallback(self):
+        cases = {
+            "double-quoted key": PEER_TEMPLATE.replace("alias = ", '"alias" = '),
+            "single-quoted key": PEER_TEMPLATE.replace("hostname = ", "'hostname' = "),
+            "quoted other key": PEER_TEMPLATE.replace("codec-preference", '"codec"'),
+            "dotted key": PEER_TEMPLATE.replace("codec-preference", "alias.x"),
+            "escaped string": PEER_TEMPLATE.replace("'Office 12'", r'"Office \"12\""'),
+            "multi-line string": PEER_TEMPLATE.replace("codec-preference = 'auto'",
+                                                       "note = '''\nalias = 'fake'\n'''"),
+            "multi-line basic string": PEER_TEMPLATE.replace("codec-preference = 'auto'",
+                                                             'note = """\nx\n"""'),
+            "not a string": PEER_TEMPLATE.replace("'Windows'", "1"),
+            "repeated table": PEER_TEMPLATE + "[options]\nalias = 'again'\n",
+        }
+        for name, text in cases.items():
+            with self.subTest(name):
+                self.assertIsNone(extract_peer_details(text))
+
+    def test_fallback_matches_parse(self):
+        # The values the full parse finds for the texts the extractor rejects
+        text = PEER_TEMPLATE.replace("alias = ", '"alias" = ')
+        self.assertIsNone(extract_peer_details(text))
+        self.assertEqual(parse_peer_details(text).alias, "Office 12")
+
+TREE_STRUCTURE = [
+    {"text": "Клиенты/ООО", "children": [
+        {"text": "123456789", "children": []},
+        {"text": "Склад", "children": [{"text": "987654321", "children": []}]},
+    ]},
+    {"text": "Пустая группа", "children": []},
+    {"text": "Офис \\ \"главный\"", "children": [{"text": "111222333", "children": []}]},
+]
+
+def tree_paths(structure, path=()):
+    for item in structure:
+        yield path + (item["text"],)
+        yield from tree_paths(item["children"], path + (item["text"],))
+
+class TreeFileTest(unittest.TestCase):
+    def setUp(self):
+        ids = itertools.count(1)
+        self.root = build_tree(TREE_STRUCTURE, lambda: next(ids))
+
+    def round_trip(self, tree_format):
+        f = io.StringIO()
+        write_tree(self.root, f, tree_format)
+        f.seek(0)
+        return list(read_tree(f, tree_format))
+
+    def test_json_round_trip(self):
+        self.assertEqual(self.round_trip("json"), list(tree_paths(TREE_STRUCTURE)))
+
+    def test_json_small_chunks(self):
+        for size in (1, 2, 3, 7):
+            with self.subTest(size), mock.patch.object(rustdeskcore, "JSON_CHUNK_SIZE", size):
+                self.assertEqual(self.round_trip("json"), list(tree_paths(TREE_STRUCTURE)))
+
+    def test_json_unknown_keys_skipped(self):
+        text = ('[{"id": 5, "text": "a", "extra": {"x": [1, {"y": null}], "z": "]"}, '
+                '"children": [{"text": "b", "children": []}]}]')
+        self.assertEqual(list(read_tree(io.StringIO(text))), [("a",), ("a", "b")])
+
+    def test_json_invalid(self):
+        cases = [
+            '[{"text": "a"} {"text": "b"}]',
+            '[,,{"text": "a"}]',
+            '[{"text": "a"},]',
+            '[{"text": "a",}]',
+            '[{"text": "a" "children": []}]',
+            '[{"text": "a", "children": [{"text": "b"}{"text": "c"}]}]',
+            '[{"text": "a", "x": [1 2]}]',
+            '[{"text": "a", "x": {"y" 1}}]',
+            '[{"text": "a", "x": [1,]}]',
+            '[{"children": [], "text": "a"}]',
+            '[{"x": 1}]',
+            '[{"text": "a"}',
+            '[{"text": "a"}] []',
+            '{"text": "a"}',
+        ]
+        for text in cases:
+            with self.subTest(text), self.assertRaises(ValueError):
+                list(read_tree(io.StringIO(text)))
+
+    def test_csv_round_trip(self):
+        self.assertEqual(self.round_trip("csv"), [
+            ("Клиенты/ООО", "123456789"),
+            ("Клиенты/ООО", "Склад", "987654321"),
+            ("Пустая группа",),
+            ("Офис \\ \"главный\"", "111222333"),
+        ])
+
+    def test_csv_separator(self):
+        text = "path,id\r\nКлиенты/ООО / Склад ,123456789\r\n / Офис / ,\r\n"
+        self.assertEqual(list(read_tree(io.StringIO(text), "csv")),
+                         [("Клиенты/ООО", "Склад", "123456789"), ("Офис",)])
+
+class PeerIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.cache_path = os.path.join(self.folder.name, "peers.json")
+        self.peer_path = os.path.join(self.folder.name, "123456789.toml")
+        with open(self.peer_path, "w", encoding="utf-8") as f:
+            f.write(PEER_TEMPLATE)
+
+    def test_round_trip(self):
+        index = PeerIndex(self.cache_path)
+        details = index.get(self.peer_path)
+        index.set_folders({self.folder.name: {"123456789.toml": (1, 2)}})
+        index.save()
+        loaded = PeerIndex(self.cache_path)
+        loaded.load()
+        self.assertEqual(loaded.entries, index.entries)
+        self.assertEqual(loaded.folders, {self.folder.name: {"123456789.toml": (1, 2)}})
+        self.assertEqual(loaded.get(self.peer_path), details)
+        self.assertEqual((loaded.hits, loaded.misses), (1, 0))
+
+    def test_get_many(self):
+        missing_path = os.path.join(self.folder.name, "987654321.toml")
+        for network in (False, True):
+            with self.subTest(network=network), mock.patch.object(rustdeskcore, "is_network_folder", lambda folder: network):
+                index = PeerIndex(self.cache_path)
+                details = index.get_many([self.peer_path, missing_path])
+                self.assertEqual(details, {self.peer_path: PeerRecord("Office 12", "user", "desktop-12", "Windows")})
+                self.assertEqual(list(index.entries), [self.peer_path])
+
+    def test_damaged_cache(self):
+        index = PeerIndex(self.cache_path)
+        index.get(self.peer_path)
+        index.save()
+        with open(self.cache_path, "rb") as f:
+            data = f.read()
+        cases = {
+            "truncated": data[:len(data) // 2],
+            "garbage": bytes(range(256)) * 4,
+            "pickle": b"\x80\x04\x95\x10\x00\x00\x00\x00\x00\x00\x00\x8c\x08builtins\x94.",
+            "wrong shape": b'{"version": 3, "entries": [[1, 2]], "folders": {}}',
+            "not an object": b"[]",
+            "old version": data.replace(b'"version":3', b'"version":2'),
+        }
+        for name, content in cases.items():
+            with self.subTest(name):
+                with open(self.cache_path, "wb") as f:
+                    f.write(content)
+                loaded = PeerIndex(self.cache_path)
+                loaded.load()
+                self.assertEqual((loaded.entries, loaded.folders), ({}, {}))
+
+    def test_missing_cache(self):
+        loaded = PeerIndex(self.cache_path)
+        loaded.load()
+        self.assertEqual((loaded.entries, loaded.folders), ({}, {}))
+
+# Stands in for RustDesk: waits until the release file exists, then exits with the peer ID
+# modulo 256 as the return code
+STUB_PROGRAM = """import os, sys, time
+while not os.path.exists(os.environ["STUB_RELEASE"]):
+    time.sleep(0.01)
+sys.exit(int(sys.argv[-1]) % 256 if sys.argv[-1].isdigit() else 0)
+"""
+
+class SessionLauncherTest(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.release_path = os.path.join(folder.name, "release")
+        self.missing_program = os.path.join(folder.name, "missing")
+        self.program = "rustdesk"
+        self.launcher = SessionLauncher(max_sessions=2)
+        # Commands of self.program run the stub with the same arguments
+        popen = subprocess.Popen
+        patcher = mock.patch("subprocess.Popen", lambda command: popen(
+            [sys.executable, "-c", STUB_PROGRAM] + command[1:] if command[0] == self.program else command))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        environ = mock.patch.dict(os.environ, {"STUB_RELEASE": self.release_path})
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.addCleanup(self.finish)
+
+    def release(self):
+        open(self.release_path, "w").close()
+
+    def finish(self):
+        self.release()
+        for session in self.launcher.sessions.values():
+            session.process.wait(10)
+
+    def poll_all(self):
+        # Polls until every session and queued connection is done, checking the limit meanwhile
+        finished = []
+        deadline = time.monotonic() + 20
+        while self.launcher.sessions or self.launcher.queue:
+            self.assertLess(time.monotonic(), deadline)
+            finished += self.launcher.poll()
+            self.assertLessEqual(sum(1 for peer_id in self.launcher.sessions if peer_id is not None), 2)
+            time.sleep(0.01)
+        return finished
+
+    def test_queue_limit(self):
+        accepted = self.launcher.connect(self.program, ["1000001", "1000002", "1000003"])
+        self.assertEqual(accepted, ["1000001", "1000002", "1000003"])
+        self.assertEqual(set(self.launcher.sessions), {"1000001", "1000002"})
+        self.assertEqual(list(self.launcher.queue), [(self.program, "1000003")])
+        self.assertEqual(self.launcher.poll(), [])
+        self.release()
+        finished = self.poll_all()
+        self.assertEqual({session.peer_id: session.returncode for session in finished},
+                         {"1000001": 1000001 % 256, "1000002": 1000002 % 256, "1000003": 1000003 % 256})
+        self.assertEqual(len(self.launcher.finished), 3)
+
+    def test_dedupe(self):
+        self.launcher.connect(self.program, ["1000001", "1000002", "1000003"])
+        self.assertEqual(self.launcher.connect(self.program, ["1000001", "1000003", "1000004", "1000004"]), ["1000004"])
+        self.assertTrue(self.launcher.is_active("1000003"))
+        self.assertFalse(self.launcher.is_active("1000005"))
+        self.release()
+        self.assertEqual(sorted(session.peer_id for session in self.poll_all()), ["1000001", "1000002", "1000003", "1000004"])
+        self.assertEqual(self.launcher.connect(self.program, ["1000001"]), ["1000001"])
+
+    def test_main_application_not_counted(self):
+        self.launcher.run(self.program)
+        self.launcher.run(self.program)
+        self.launcher.connect(self.program, ["1000001", "1000002"])
+        self.assertEqual(set(self.launcher.sessions), {None, "1000001", "1000002"})
+        self.release()
+        self.assertEqual(len(self.poll_all()), 3)
+
+    def test_launch_error(self):
+        self.assertEqual(self.launcher.connect(self.missing_program, ["1000001"]), ["1000001"])
+        self.assertEqual(self.launcher.sessions, {})
+        self.assertEqual([program for program, error in self.launcher.errors], [self.missing_program])
+
+if __name__ == "__main__":
+    unittest.main()